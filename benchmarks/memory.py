@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Measure the memory held by collected test cases with ``tracemalloc``.
+
+Generate a synthetic test package, 50000 tests by default, and compare the
+memory held after collection when keeping ``TestFunction`` instances, which
+pin the syntax tree of every module, and when keeping the ``TestRecord``
+instances returned by ``get_testcases``.
+
+Usage::
+
+    python benchmarks/memory.py [--modules N] [--classes N] [--tests N]
+"""
+import argparse
+import ast
+import gc
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+from parse_count import generate
+
+from testimony import RunContext, TestFunction, get_testcases, is_test_module
+
+
+def collect_functions(root):
+    """Return the ``TestFunction`` instances of the test modules of root."""
+    context = RunContext()
+    testcases = []
+    for filename in sorted(os.listdir(root)):
+        if not is_test_module(filename):
+            continue
+        path = os.path.join(root, filename)
+        with open(path) as handler:
+            module = ast.parse(handler.read())
+        module.path = path
+        for node in module.body:
+            if isinstance(node, ast.ClassDef):
+                for subnode in node.body:
+                    if isinstance(subnode, ast.FunctionDef):
+                        testcase = TestFunction(subnode, node, module, context)
+                        # Parse the docstrings, like the records are
+                        testcase.tokens
+                        testcases.append(testcase)
+    return testcases
+
+
+def collect_records(root):
+    """Return the ``TestRecord`` instances of the test modules of root."""
+    return get_testcases([root])
+
+
+def measure(function, root):
+    """Return the test cases count, held and peak memory of ``function``."""
+    gc.collect()
+    tracemalloc.start()
+    testcases = function(root)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if isinstance(testcases, dict):
+        count = sum(len(tests) for tests in testcases.values())
+    else:
+        count = len(testcases)
+    return count, current, peak
+
+
+def main():
+    """Run the benchmark and print the memory usage."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', type=int, default=100)
+    parser.add_argument('--classes', type=int, default=10)
+    parser.add_argument('--tests', type=int, default=50)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        generate(root, args.modules, args.classes, args.tests)
+        for label, function in (
+                ('functions', collect_functions),
+                ('records', collect_records)):
+            count, current, peak = measure(function, root)
+            print('{0:>9}: {1} tests, {2:.1f} MiB held, {3:.1f} MiB peak'
+                  .format(label, count, current / 2 ** 20, peak / 2 ** 20))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
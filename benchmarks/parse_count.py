@@ -0,0 +1,120 @@
+# coding=utf-8
+"""Count docstring parses with and without the scope cache.
+
+Generate a synthetic test package and build every ``TestFunction`` twice:
+once with a new ``RunContext`` per test, which parses the package, module
+and class docstrings for every test, and once sharing a single context,
+whose scope cache makes each of them parsed only once.
+
+Usage::
+
+    python benchmarks/parse_count.py [--modules N] [--classes N] [--tests N]
+"""
+import argparse
+import ast
+import os
+import shutil
+import tempfile
+import time
+
+from testimony import RunContext, TestFunction
+from testimony.parser import DocstringParser
+
+MODULE_TEMPLATE = '''"""Module {module}.
+
+:Setup: Module setup
+"""
+'''
+
+CLASS_TEMPLATE = '''
+
+class TestClass{klass}():
+    """Class {klass}.
+
+    :Feature: Class feature
+    """
+'''
+
+TEST_TEMPLATE = '''
+    def test_{test}(self):
+        """Test {test}.
+
+        :Assert: Test {test} works
+        """
+'''
+
+
+def generate(root, modules, classes, tests):
+    """Write a synthetic test package under ``root``."""
+    with open(os.path.join(root, '__init__.py'), 'w') as handler:
+        handler.write('"""Package.\n\n:Tags: benchmark\n"""\n')
+    for module in range(modules):
+        source = MODULE_TEMPLATE.format(module=module)
+        for klass in range(classes):
+            source += CLASS_TEMPLATE.format(klass=klass)
+            for test in range(tests):
+                source += TEST_TEMPLATE.format(test=test)
+        path = os.path.join(root, 'test_module{0}.py'.format(module))
+        with open(path, 'w') as handler:
+            handler.write(source)
+
+
+def collect(root, context):
+    """Build every ``TestFunction`` under ``root`` and return their count.
+
+    A new ``RunContext`` is created for each test when ``context`` is
+    ``None``.
+    """
+    count = 0
+    for filename in sorted(os.listdir(root)):
+        if not filename.startswith('test_'):
+            continue
+        path = os.path.join(root, filename)
+        with open(path) as handler:
+            module = ast.parse(handler.read())
+        module.path = path
+        for node in module.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for subnode in node.body:
+                if not isinstance(subnode, ast.FunctionDef):
+                    continue
+                # Docstrings are parsed on first access to the tokens
+                TestFunction(subnode, node, module, context).tokens
+                count += 1
+    return count
+
+
+def main():
+    """Run the benchmark and print the parse counts."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', type=int, default=20)
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--tests', type=int, default=10)
+    args = parser.parse_args()
+
+    calls = [0]
+    original_parse = DocstringParser.parse
+
+    def counting_parse(self, docstring=None):
+        calls[0] += 1
+        return original_parse(self, docstring)
+
+    DocstringParser.parse = counting_parse
+    root = tempfile.mkdtemp()
+    try:
+        generate(root, args.modules, args.classes, args.tests)
+        for label, context in (('uncached', None), ('cached', RunContext())):
+            calls[0] = 0
+            start = time.perf_counter()
+            tests = collect(root, context)
+            elapsed = time.perf_counter() - start
+            print('{0:>8}: {1} tests, {2} parses, {3:.2f}s'.format(
+                label, tests, calls[0], elapsed))
+    finally:
+        DocstringParser.parse = original_parse
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
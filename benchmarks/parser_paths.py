@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Compare the XML and document tree based docutils parsing paths.
+
+Before walking the document tree, ``DocstringParser`` rendered every
+docstring to XML with ``publish_string`` and parsed it back with
+``ElementTree``. This benchmark keeps a copy of that path and times both on
+the docstrings of the given test modules, checking that they extract the
+same tokens. The fast path and the memo are disabled so docutils runs for
+each docstring.
+
+Usage::
+
+    python benchmarks/parser_paths.py [--repeat N] [PATH...]
+"""
+import argparse
+import ast
+import time
+from io import StringIO
+from xml.etree import ElementTree
+
+from docutils.core import publish_string
+
+from testimony import get_testmodules
+from testimony.parser import (
+    EMPTY_BODY,
+    DocstringParser,
+    _no_docinfo_reader_class,
+)
+
+
+def xml_parse(parser, docstring):
+    """Parse ``docstring`` going through an XML document."""
+    warning_stream = StringIO()
+    docstring_xml = publish_string(
+        docstring,
+        reader=_no_docinfo_reader_class()(),
+        settings_overrides={
+            'embed_stylesheet': False,
+            'input_encoding': 'utf-8',
+            'syntax_highlight': 'short',
+            'warning_stream': warning_stream,
+        },
+        writer_name='xml',
+    )
+    fields = []
+    root = ElementTree.fromstring(docstring_xml)
+    for token in root.findall('./field_list/field'):
+        token_name = token.find('./field_name').text.lower()
+        value_el = token.find('./field_body/')
+        if value_el is None:
+            fields.append((token_name, EMPTY_BODY))
+            continue
+        if value_el.tag == 'paragraph':
+            value = value_el.text
+        if value_el.tag == 'enumerated_list':
+            value = '\n'.join(
+                u'{}. {}'.format(number, elem.text)
+                for number, elem in enumerate(
+                    value_el.findall('./list_item/paragraph'), start=1)
+            )
+        fields.append((token_name, value))
+    return parser._split_fields(fields)
+
+
+def doctree_parse(parser, docstring):
+    """Parse ``docstring`` walking the document tree."""
+    return parser.parse(docstring)[:2]
+
+
+def docstrings(paths):
+    """Return the docstrings found on the test modules of ``paths``."""
+    result = []
+    for testmodule in get_testmodules(paths):
+        with open(testmodule) as handler:
+            root = ast.parse(handler.read())
+        for node in ast.walk(root):
+            if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef)):
+                docstring = ast.get_docstring(node)
+                if docstring is not None:
+                    result.append(docstring)
+    return result
+
+
+def main():
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('paths', nargs='*', default=['tests/test_sample.py'])
+    args = parser.parse_args()
+
+    docstring_parser = DocstringParser(fast=False, memo_size=0)
+    corpus = docstrings(args.paths)
+    for docstring in corpus:
+        expected = xml_parse(docstring_parser, docstring)
+        if doctree_parse(docstring_parser, docstring) != expected:
+            raise SystemExit('Mismatch for {0!r}'.format(docstring))
+
+    timings = {}
+    for label, function in (('xml', xml_parse), ('doctree', doctree_parse)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for docstring in corpus:
+                function(docstring_parser, docstring)
+        timings[label] = time.perf_counter() - start
+        print('{0:>8}: {1} docstrings x {2}, {3:.3f}s ({4:.2f}ms each)'.format(
+            label, len(corpus), args.repeat, timings[label],
+            timings[label] * 1000 / (len(corpus) * args.repeat)))
+    print(' speedup: {0:.2f}x'.format(timings['xml'] / timings['doctree']))
+
+
+if __name__ == '__main__':
+    main()
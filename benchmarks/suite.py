@@ -0,0 +1,211 @@
+# coding=utf-8
+"""Time test case collection and every report on a synthetic test tree.
+
+Generate a synthetic test tree, see ``synthetic.py``, then measure:
+
+* ``get_testcases`` alone;
+* the ``print`` report in text, JSON and markdown modes;
+* the ``summary`` and ``validate`` reports in text and JSON modes.
+
+Reports are measured the way ``testimony`` runs them, test modules being
+parsed as the report goes, and their output is discarded. Each measurement
+runs ``--repeat`` times on a fresh interpreter, the best wall and CPU times
+are kept as well as the highest peak RSS. Results are printed and, with
+``--output``, stored as JSON along with the generator parameters and the
+current git commit. Pass a previous results file to ``--compare`` to print
+the ratio of every time to the previous one.
+
+Usage::
+
+    python benchmarks/suite.py [--output FILE] [--compare FILE]
+        [--repeat N] [generator options]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MEASUREMENTS = (
+    ('get_testcases', None),
+    ('print', 'text'),
+    ('print', 'json'),
+    ('print', 'markdown'),
+    ('summary', 'text'),
+    ('summary', 'json'),
+    ('validate', 'text'),
+    ('validate', 'json'),
+)
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in KiB."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes instead of KiB
+        rss //= 1024
+    return rss
+
+
+def measure(root, name, mode):
+    """Run one measurement and return its wall time, CPU time and peak RSS.
+
+    Meant to run on a fresh interpreter, see ``run``.
+    """
+    import testimony
+    from testimony import (
+        RunContext,
+        get_testcases,
+        iter_testcases,
+        print_report,
+        summary_report,
+        validate_docstring_report,
+    )
+
+    testimony.SETTINGS['nocolor'] = True
+    testimony.SETTINGS['json'] = mode == 'json'
+    testimony.SETTINGS['markdown'] = mode == 'markdown'
+    reports = {
+        'print': print_report,
+        'summary': summary_report,
+        'validate': validate_docstring_report,
+    }
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if name == 'get_testcases':
+        get_testcases([root])
+    else:
+        report = reports[name]
+        context = RunContext(names_only=report is summary_report)
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                report(iter_testcases([root], context=context))
+    return (
+        time.perf_counter() - wall,
+        time.process_time() - cpu,
+        peak_rss(),
+    )
+
+
+def run(root, repeat):
+    """Return the results of every measurement on the ``root`` tree."""
+    spawn = multiprocessing.get_context('spawn')
+    results = []
+    for name, mode in MEASUREMENTS:
+        walls, cpus, rss = [], [], []
+        for _ in range(repeat):
+            with spawn.Pool(1) as pool:
+                wall, cpu, peak = pool.apply(measure, (root, name, mode))
+            walls.append(wall)
+            cpus.append(cpu)
+            rss.append(peak)
+        results.append({
+            'name': name,
+            'mode': mode,
+            'wall': min(walls),
+            'cpu': min(cpus),
+            'peak_rss_kib': None if None in rss else max(rss),
+        })
+    return results
+
+
+def git_commit():
+    """Return the current git commit or ``None``."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def label(result):
+    """Return the ``name`` and ``mode`` of a result as a single label."""
+    if result['mode'] is None:
+        return result['name']
+    return '{0} ({1})'.format(result['name'], result['mode'])
+
+
+def print_results(results, previous=None):
+    """Print ``results``, compared with ``previous`` results if given."""
+    previous = {
+        label(result): result for result in (previous or {}).get(
+            'results', [])
+    }
+    print('{0:<20}  {1:>9}  {2:>9}  {3:>10}{4}'.format(
+        'Measurement', 'Wall (s)', 'CPU (s)', 'RSS (MiB)',
+        '  {0:>7}'.format('Ratio') if previous else ''))
+    for result in results:
+        ratio = ''
+        if label(result) in previous:
+            ratio = '  {0:>7.2f}'.format(
+                result['wall'] / previous[label(result)]['wall'])
+        elif previous:
+            ratio = '  {0:>7}'.format('-')
+        rss = result['peak_rss_kib']
+        print('{0:<20}  {1:>9.3f}  {2:>9.3f}  {3:>10}{4}'.format(
+            label(result), result['wall'], result['cpu'],
+            '-' if rss is None else '{0:.1f}'.format(rss / 1024), ratio))
+
+
+def main():
+    """Generate the tree, run the measurements and report the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--output', help='Store the results as JSON on this file')
+    parser.add_argument(
+        '--compare', type=argparse.FileType(),
+        help='Previous results file to compare with')
+    parser.add_argument('--repeat', type=int, default=3)
+    synthetic.add_arguments(parser)
+    args = parser.parse_args()
+    previous = json.load(args.compare) if args.compare else None
+
+    options = synthetic.generator_options(args)
+    root = tempfile.mkdtemp()
+    try:
+        tests = synthetic.generate(root, **options)
+        results = run(root, args.repeat)
+    finally:
+        shutil.rmtree(root)
+
+    print_results(results, previous)
+    if args.output:
+        data = {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'tests': tests,
+            'generator': options,
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'w') as handler:
+            json.dump(data, handler, indent=2)
+            handler.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+# coding=utf-8
+"""Generate synthetic test trees for the benchmarks.
+
+The generated tree is a package nested ``depth`` levels deep, every level
+having its own ``__init__.py`` and test modules. Test docstrings look like
+the ones of real test suites: a summary, some description lines, a few
+fields with inline markup and an enumerated list of steps. A share of them
+have an invalid RST list, which makes docutils report parsing issues.
+
+Usage::
+
+    python benchmarks/synthetic.py DIRECTORY [--modules N] [--classes N]
+        [--tests N] [--docstring-lines N] [--invalid-share RATIO]
+        [--depth N] [--seed N]
+"""
+import argparse
+import os
+import random
+
+PACKAGE_TEMPLATE = '''"""Package level {level}.
+
+:Feature: Package {level}
+:Tags: benchmark, level{level}
+"""
+'''
+
+MODULE_TEMPLATE = '''"""Test module {module}.
+
+:Setup: Prepare ``module{module}`` fixtures
+:Type: Functional
+"""
+import pytest
+'''
+
+CLASS_TEMPLATE = '''
+
+class TestClass{klass}:
+    """Tests of class {klass}.
+
+    :Feature: Class {klass} feature
+    """
+'''
+
+TEST_TEMPLATE = '''
+    @pytest.mark.tier{tier}
+    def test_{test}(self):
+        """{summary}
+{description}
+        :id: {id}
+
+        :Steps:
+{steps}
+        :Assert: The ``{test}`` result is *valid*
+
+        :BZ: {bz}
+        """
+'''
+
+# An item continuation line not aligned with the item text, reported by
+# docutils as "Enumerated list ends without a blank line"
+INVALID_STEP = (
+    '            {number}. Run the step number {number} of the test which\n'
+    '            spans two lines not aligned with the item text\n'
+)
+
+STEP = (
+    '            {number}. Run the step number {number} with '
+    '``option{number}``\n'
+)
+
+WORDS = (
+    'create', 'update', 'delete', 'search', 'host', 'organization', 'user',
+    'content', 'view', 'repository', 'with', 'valid', 'invalid', 'name',
+    'positive', 'negative', 'synchronize', 'publish', 'promote', 'filter',
+)
+
+DEFAULTS = {
+    'modules': 50,
+    'classes': 5,
+    'tests': 20,
+    'docstring_lines': 3,
+    'invalid_share': 0.05,
+    'depth': 2,
+    'seed': 0,
+}
+
+
+def _sentence(rand, words):
+    """Return a sentence of ``words`` random words."""
+    return ' '.join(rand.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _docstring_fields(rand, test, docstring_lines, invalid):
+    """Return the values to format ``TEST_TEMPLATE`` with."""
+    description = ''.join(
+        '        {0}.\n'.format(_sentence(rand, 10))
+        for _ in range(docstring_lines)
+    )
+    if description:
+        description = '\n' + description
+    steps = ''.join(
+        (INVALID_STEP if invalid and number == 2 else STEP).format(
+            number=number)
+        for number in range(1, 4)
+    )
+    return {
+        'test': test,
+        'tier': rand.randint(1, 3),
+        'summary': _sentence(rand, 6),
+        'description': description,
+        'id': '{0:08x}-{1:04x}'.format(
+            rand.getrandbits(32), rand.getrandbits(16)),
+        'steps': steps,
+        'bz': rand.randint(100000, 999999),
+    }
+
+
+def generate(root, modules=DEFAULTS['modules'], classes=DEFAULTS['classes'],
+             tests=DEFAULTS['tests'],
+             docstring_lines=DEFAULTS['docstring_lines'],
+             invalid_share=DEFAULTS['invalid_share'], depth=DEFAULTS['depth'],
+             seed=DEFAULTS['seed']):
+    """Write a synthetic test tree under ``root`` and return its test count.
+
+    :param modules: Number of test modules, spread over the package levels.
+    :param classes: Number of test classes per module.
+    :param tests: Number of test methods per class.
+    :param docstring_lines: Number of description lines per test docstring.
+    :param invalid_share: Share of test docstrings with invalid RST.
+    :param depth: Number of nested packages, each one with an
+        ``__init__.py``. Test modules are written on the top directory when
+        it is ``0``.
+    :param seed: Seed of the random generator, the same parameters and seed
+        generate the same tree.
+    """
+    rand = random.Random(seed)
+    directories = [root]
+    for level in range(depth):
+        directory = os.path.join(directories[-1], 'level{0}'.format(level))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '__init__.py'), 'w') as handler:
+            handler.write(PACKAGE_TEMPLATE.format(level=level))
+        directories.append(directory)
+    if depth:
+        directories = directories[1:]
+    count = 0
+    for module in range(modules):
+        source = [MODULE_TEMPLATE.format(module=module)]
+        for klass in range(classes):
+            source.append(CLASS_TEMPLATE.format(klass=klass))
+            for test in range(tests):
+                invalid = rand.random() < invalid_share
+                source.append(TEST_TEMPLATE.format(**_docstring_fields(
+                    rand, test, docstring_lines, invalid)))
+                count += 1
+        path = os.path.join(
+            directories[module % len(directories)],
+            'test_module{0}.py'.format(module),
+        )
+        with open(path, 'w') as handler:
+            handler.write(''.join(source))
+    return count
+
+
+def add_arguments(parser):
+    """Add the ``generate`` parameters as options of ``parser``."""
+    parser.add_argument('--modules', type=int, default=DEFAULTS['modules'])
+    parser.add_argument('--classes', type=int, default=DEFAULTS['classes'])
+    parser.add_argument('--tests', type=int, default=DEFAULTS['tests'])
+    parser.add_argument(
+        '--docstring-lines', type=int, default=DEFAULTS['docstring_lines'])
+    parser.add_argument(
+        '--invalid-share', type=float, default=DEFAULTS['invalid_share'])
+    parser.add_argument('--depth', type=int, default=DEFAULTS['depth'])
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+
+
+def generator_options(args):
+    """Return the ``generate`` keyword arguments from parsed ``args``."""
+    return {name: getattr(args, name) for name in DEFAULTS}
+
+
+def main():
+    """Generate a synthetic test tree on the given directory."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    add_arguments(parser)
+    args = parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+    count = generate(args.directory, **generator_options(args))
+    print('{0} tests written on {1}'.format(count, args.directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,7 @@ setup(
     entry_points="""
         [console_scripts]
         testimony=testimony.cli:testimony
+        testimony-client=testimony.client:main
     """,
     description='Testimony inspects and reports on the python test cases.',
     long_description=long_description,
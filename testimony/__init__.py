@@ -4,17 +4,33 @@ from __future__ import print_function, unicode_literals
 
 import ast
 import collections
+import collections.abc
 import copy
 import fnmatch
+import functools
+import hashlib
 import itertools
 import json
+import mmap
 import os
+import re
 import sys
 import textwrap
 
 from testimony.constants import (
     CLR_ERR,
     CLR_GOOD,
+    DEFAULT_EXCLUDE_PATTERNS,
+    DEFAULT_PARSE_MEMO_SIZE,
+    DEFAULT_SOCKET_PATH,
+    DEFAULT_TEST_MODULE_PATTERNS,
+    ISSUE_CATEGORIES,
+    ISSUE_INVALID_TOKEN_VALUES,
+    ISSUE_MINIMUM_TOKENS,
+    ISSUE_MISSING_DOCSTRING,
+    ISSUE_RST_PARSING,
+    ISSUE_UNEXPECTED_TOKENS,
+    JUNIT_FORMAT,
     PRINT_INVALID_DOC,
     PRINT_INVALID_VALUE,
     PRINT_NO_DOC,
@@ -23,22 +39,30 @@ from testimony.constants import (
     PRINT_RST_PARSING_ISSUE,
     PRINT_TOTAL_TC,
     PRINT_UNEXPECTED_DOC_TC,
+    SARIF_FORMAT,
+    SERVE_MODE,
     SUMMARY_REPORT,
     VALIDATE_DOCSTRING_REPORT,
 )
+from testimony.output import (
+    JSONArrayWriter,
+    JSONLinesWriter,
+    JUnitWriter,
+    SARIFWriter,
+    TextWriter,
+)
 from testimony.parser import DocstringParser
-
-try:
-    import termcolor
-    HAS_TERMCOLOR = True
-except ImportError:
-    HAS_TERMCOLOR = False
+from testimony.profiling import NULL_PROFILER, Profiler
 
 SETTINGS = {
     'json': False,
+    'jsonl': False,
+    'format': None,
     'markdown': False,
     'nocolor': False,
     'tokens': {},
+    'include': DEFAULT_TEST_MODULE_PATTERNS,
+    'exclude': DEFAULT_EXCLUDE_PATTERNS,
 }
 
 
@@ -62,12 +86,108 @@ def indent(text, prefix, predicate=None):
     return ''.join(prefixed_lines())
 
 
+# Whitespace textwrap replaces by spaces
+_WRAP_WHITESPACE_RE = re.compile(r'[\t\n\x0b\x0c\r]')
+
+
+def fill_item(text, width=70):
+    """Fill ``text`` as an indented list item, like ``textwrap.fill``.
+
+    The first line is indented by 2 spaces and the next ones by 4. Text which
+    fits on the first line, the most common case, is returned without
+    calling ``textwrap``.
+    """
+    if (text and len(text) <= width - 2 and not text[-1].isspace() and
+            not _WRAP_WHITESPACE_RE.search(text)):
+        return '  ' + text
+    return textwrap.fill(
+        text, width=width, initial_indent=' ' * 2, subsequent_indent=' ' * 4)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_patterns(patterns):
+    """Compile a tuple of shell-style ``patterns`` into a single regex.
+
+    The regex matches whatever one of the patterns matches, and nothing when
+    there is no pattern.
+    """
+    if not patterns:
+        return re.compile('(?!)')
+    return re.compile('|'.join(
+        '(?:{0})'.format(fnmatch.translate(pattern)) for pattern in patterns))
+
+
 def is_test_module(filename):
-    """Indicate if ``filename`` match a test module file name."""
-    for pat in ('test_*.py', '*_test.py'):
-        if fnmatch.fnmatch(filename, pat):
-            return True
-    return False
+    """Indicate if ``filename`` match a test module file name.
+
+    Test module file names are configured by ``SETTINGS['include']``.
+    """
+    return compile_patterns(
+        tuple(SETTINGS['include'])).match(filename) is not None
+
+
+def _match_excluded(exclude, relpath, root_name):
+    """Indicate if the ``exclude`` regex matches ``relpath``, see below."""
+    return bool(
+        exclude.match(os.path.basename(relpath)) or
+        exclude.match(relpath) or
+        exclude.match(os.path.join(root_name, relpath))
+    )
+
+
+def is_excluded(path, root=os.curdir):
+    """Indicate if ``path`` is excluded from the walk of ``root``.
+
+    ``path`` is relative to the walked ``root`` directory. It is excluded
+    when its base name, ``path`` or ``path`` prefixed by the name of
+    ``root`` match one of the ``SETTINGS['exclude']`` patterns, so the
+    result doesn't depend on how ``root`` is spelled.
+    """
+    exclude = compile_patterns(tuple(SETTINGS['exclude']))
+    return _match_excluded(
+        exclude,
+        os.path.normpath(path),
+        os.path.basename(os.path.abspath(root)),
+    )
+
+
+def walk_testmodules(path):
+    """Walk the ``path`` directory and yield the test modules found.
+
+    Yields a ``(dirpath, testmodules)`` tuple for ``path`` and every
+    subdirectory, in the same order as ``os.walk``. Excluded files and
+    directories are skipped, and so is the content of excluded directories,
+    see ``is_excluded``. Symbolic links to directories are not followed.
+    """
+    include = compile_patterns(tuple(SETTINGS['include']))
+    exclude = compile_patterns(tuple(SETTINGS['exclude']))
+    root_name = os.path.basename(os.path.abspath(path))
+    # Directories to walk along with their path relative to ``path``
+    stack = [(path, '')]
+    while stack:
+        dirpath, reldirpath = stack.pop()
+        testmodules = []
+        subdirs = []
+        try:
+            entries = os.scandir(dirpath)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                relpath = os.path.join(reldirpath, entry.name)
+                if _match_excluded(exclude, relpath, root_name):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    if include.match(entry.name):
+                        testmodules.append(entry.path)
+                elif not entry.is_symlink():
+                    subdirs.append((entry.path, relpath))
+        yield dirpath, testmodules
+        stack.extend(reversed(subdirs))
 
 
 def testcase_title(testcase):
@@ -82,109 +202,167 @@ def testcase_title(testcase):
     return '{0}{1}:{2}'.format(
         testcase.parent_class + '::' if testcase.parent_class else '',
         testcase.name,
-        testcase.function_def.lineno,
+        testcase.lineno,
     )
 
 
-class TestFunction(object):
-    """Wrapper for ``ast.FunctionDef`` which parse docstring information.
+def percentage(value, total):
+    """Calculate the percentage of ``value`` on ``total``, 0 if it is 0."""
+    if not total:
+        return 0.0
+    return float(value) / total * 100
 
-    The ``tokens`` and ``invalid_tokens`` parameters provide meaningful
-    information about the test.
+
+def iter_items(testcases):
+    """Return the ``(path, tests)`` pairs of ``testcases``.
+
+    ``testcases`` is either a dict mapping test module paths to their test
+    cases, as returned by ``get_testcases``, or an iterable of pairs, as
+    yielded by ``iter_testcases``.
     """
+    if isinstance(testcases, collections.abc.Mapping):
+        return testcases.items()
+    return testcases
 
-    def __init__(self, function_def, parent_class=None, testmodule=None):
-        """Wrap a ``ast.FunctionDef`` instance used to extract information."""
-        self.docstring = ast.get_docstring(function_def)
-        self.function_def = function_def
-        self.name = function_def.name
-        if parent_class:
-            self.parent_class = parent_class.name
-            self.parent_class_def = parent_class
-            self.class_docstring = ast.get_docstring(self.parent_class_def)
-        else:
-            self.parent_class = None
-            self.parent_class_def = None
-            self.class_docstring = None
-        self.testmodule = testmodule.path
-        self.module_def = testmodule
-        self.module_docstring = ast.get_docstring(self.module_def)
-        self.pkginit = os.path.join(
-            os.path.dirname(self.testmodule), '__init__.py')
-        if os.path.exists(self.pkginit):
-            self.pkginit_def = ast.parse(''.join(open(self.pkginit)))
-            self.pkginit_docstring = ast.get_docstring(self.pkginit_def)
+
+PackageInit = collections.namedtuple('PackageInit', 'path docstring')
+
+
+class PackageRegistry(object):
+    """Per-run registry of package ``__init__.py`` metadata.
+
+    Every ``__init__.py`` is read and parsed at most once per run and the
+    resulting ``PackageInit`` is handed to all test functions living in that
+    package. Only the docstring is kept, not the syntax tree, and files with
+    identical content are parsed once.
+
+    When ``parents`` is ``True`` the lineage of a package also includes its
+    parent packages, up to the first directory without an ``__init__.py``.
+    """
+
+    def __init__(self, parents=False):
+        """Initialize an empty registry."""
+        self.parents = parents
+        self._packages = {}
+        self._digests = {}
+
+    def get(self, dirpath):
+        """Return the ``PackageInit`` of ``dirpath`` or ``None``."""
+        try:
+            return self._packages[dirpath]
+        except KeyError:
+            pass
+        path = os.path.join(dirpath, '__init__.py')
+        try:
+            with open(path, 'rb') as handler:
+                source = handler.read()
+        except (IOError, OSError):
+            package = None
         else:
-            self.pkginit_def = None
-            self.pkginit_docstring = None
-        self.tokens = {}
-        self.invalid_tokens = {}
-        self._rst_parser_messages = []
-        tokens = SETTINGS.get('tokens').keys() or None
-        minimum_tokens = [key for key, value
-                          in SETTINGS.get('tokens').items()
-                          if value.required] or None
-        self.parser = DocstringParser(tokens, minimum_tokens)
-        self._parse_docstring()
-        self._parse_decorators()
-
-    def _parse_docstring(self):
-        """Parse module, class and function docstrings.
+            digest = hashlib.sha1(source).hexdigest()
+            if digest not in self._digests:
+                self._digests[digest] = ast.get_docstring(ast.parse(source))
+            package = PackageInit(path, self._digests[digest])
+        self._packages[dirpath] = package
+        return package
+
+    def lineage(self, dirpath):
+        """Return the ``PackageInit`` chain of ``dirpath``, outermost first."""
+        packages = []
+        package = self.get(dirpath)
+        while package is not None:
+            packages.insert(0, package)
+            parent = os.path.dirname(dirpath)
+            if not self.parents or parent == dirpath:
+                break
+            dirpath = parent
+            package = self.get(dirpath)
+        return packages
+
+    def forget(self, dirpath):
+        """Drop the ``PackageInit`` of ``dirpath`` so it is read again."""
+        self._packages.pop(dirpath, None)
+
+
+class RunContext(object):
+    """State shared by the test functions collected during a run.
+
+    The ``DocstringParser`` is built once from ``tokens``, a dict mapping
+    token names to ``TokenConfig`` which defaults to ``SETTINGS['tokens']``.
+    The context also holds the scope cache and package registry of the run,
+    see ``TestFunction`` and ``PackageRegistry``. Scope cache keys are
+    ``(path, lineno)`` tuples, optionally followed by the kind of parsing.
+    """
+
+    def __init__(self, tokens=None, names_only=False, profiler=None,
+                 memo_size=DEFAULT_PARSE_MEMO_SIZE):
+        """Initialize the context for the ``tokens`` configuration.
 
-        ``tokens`` and ``invalid_tokens`` attributes will be updated  with the
-        parsed values.
+        When ``names_only`` is ``True`` the test cases of the run only need
+        their token names, see ``TestFunction.to_record``. The stages of the
+        run are timed by ``profiler``, a ``testimony.profiling.Profiler``,
+        when it is given. ``memo_size`` is the size of the parser memo, see
+        ``DocstringParser``.
         """
-        if self.docstring is None:
-            return
-
-        # Parse module, class and function docstrings. Every loop updates the
-        # already defined tokens and invalid_tokens. The order of processing
-        # ensures that function docstring has more priority over class and
-        # module docstrings respectively.
-        docstrings = [
-            self.pkginit_docstring,
-            self.module_docstring,
-            self.class_docstring,
-            self.docstring,
-        ]
-        for docstring in docstrings:
-            if docstring and not isinstance(docstring, type(u'')):
-                docstring = docstring.decode('utf-8')
-            tokens, invalid_tokens, rst_messages = self.parser.parse(docstring)
-            self.tokens.update(tokens)
-            self.invalid_tokens.update(invalid_tokens)
-            if docstring == docstrings[-1]:
-                self._rst_parser_messages = rst_messages
+        if tokens is None:
+            tokens = SETTINGS['tokens']
+        self.tokens = tokens
+        self.names_only = names_only
+        self.profiler = profiler or NULL_PROFILER
+        self.parser = DocstringParser(
+            tokens.keys() or None,
+            [key for key, value in tokens.items() if value.required] or None,
+            memo_size=memo_size,
+        )
+        self.parser.profiler = self.profiler
+        self.scope_cache = {}
+        self.package_registry = PackageRegistry()
+
+    def forget(self, path):
+        """Drop the cached information of the ``path`` source file.
+
+        Use it when a test module or a package ``__init__.py`` changed during
+        the lifetime of the context.
+        """
+        for key in [key for key in self.scope_cache if key[0] == path]:
+            del self.scope_cache[key]
+        dirpath, filename = os.path.split(path)
+        if filename == '__init__.py':
+            self.package_registry.forget(dirpath)
 
-        # Always use the first line of docstring as test case name
-        if self.tokens.get('test') is None:
-            if docstring and not isinstance(docstring, type(u'')):
-                docstring = self.docstring.decode('utf-8')
-            self.tokens['test'] = docstring.strip().split('\n')[0]
 
-    def _parse_decorators(self):
-        """Get decorators from class and function definition.
+class TestRecord(object):
+    """Information extracted from a test function, used by the reports.
 
-        Modules and packages can't be decorated, so they are skipped.
-        Decorator can be pytest marker or function call.
-        ``tokens`` attribute will be updated with new value ``decorators``.
-        """
-        token_decorators = []
-        for level in (self.parent_class_def, self.function_def):
-            decorators = getattr(level, 'decorator_list', None)
-            if not decorators:
-                continue
+    A record holds no ``ast`` node, so the syntax tree of a test module can
+    be freed as soon as its test cases are extracted. It is also what gets
+    pickled by the process pool and the parse cache.
+    """
 
-            for decorator in decorators:
-                try:
-                    token_decorators.append(
-                        getattr(decorator, 'func', decorator).id
-                    )
-                except AttributeError:
-                    continue
+    __slots__ = (
+        'name',
+        'parent_class',
+        'testmodule',
+        'lineno',
+        'docstring',
+        'tokens',
+        'invalid_tokens',
+        '_rst_parser_messages',
+        'parser',
+    )
 
-        if token_decorators:
-            self.tokens['decorators'] = token_decorators
+    def __init__(self, name, parent_class, testmodule, lineno, docstring,
+                 tokens, invalid_tokens, rst_parser_messages, parser):
+        """Initialize the record, ``parser`` is the ``DocstringParser``."""
+        self.name = name
+        self.parent_class = parent_class
+        self.testmodule = testmodule
+        self.lineno = lineno
+        self.docstring = docstring
+        self.tokens = tokens
+        self.invalid_tokens = invalid_tokens
+        self._rst_parser_messages = rst_parser_messages
+        self.parser = parser
 
     @property
     def has_valid_docstring(self):
@@ -258,45 +436,439 @@ class TestFunction(object):
             output.append(
                 'Unexpected tokens:\n' +
                 '\n'.join([
-                    textwrap.fill(
-                        '{0}: {1}'.format(key.capitalize(), value),
-                        initial_indent=' ' * 2,
-                        subsequent_indent=' ' * 4
-                    )
+                    fill_item('{0}: {1}'.format(key.capitalize(), value))
                     for key, value in sorted(self.invalid_tokens.items())
                 ])
             )
         return '\n'.join(output)
 
 
-def main(report, paths, json_output, markdown_output, nocolor):
-    """Entry point for the testimony project.
+class TestFunction(TestRecord):
+    """Wrapper for ``ast.FunctionDef`` which parse docstring information.
 
-    Expects a valid report type and valid directory paths, hopefully argparse
-    is taking care of validation
+    The ``tokens`` and ``invalid_tokens`` parameters provide meaningful
+    information about the test. The wrapped ``ast`` nodes are kept, use
+    ``to_record`` to get a ``TestRecord`` which doesn't hold them.
+
+    Docstrings are parsed on demand: the first access to ``tokens``,
+    ``invalid_tokens`` or the RST parser messages parses them all, while
+    ``token_names`` only looks for the token names.
+    """
+
+    def __init__(self, function_def, parent_class=None, testmodule=None,
+                 context=None, outer_classes=()):
+        """Wrap a ``ast.FunctionDef`` instance used to extract information.
+
+        ``ast.AsyncFunctionDef`` instances are wrapped the same way.
+
+        ``context`` is the ``RunContext`` shared between the test functions of
+        a run. Its scope cache maps package, module and class docstrings to
+        their parsed tokens, so each inherited docstring is parsed only once.
+        A new context is created when it is not provided.
+
+        ``outer_classes`` are the classes enclosing ``parent_class``, from the
+        outermost one, when it is a nested class. Their names prefix the
+        ``parent_class`` name and their docstrings and decorators are
+        inherited too.
+        """
+        if context is None:
+            context = RunContext()
+        self.docstring = ast.get_docstring(function_def)
+        self.function_def = function_def
+        self.name = function_def.name
+        self.lineno = function_def.lineno
+        if parent_class:
+            self.outer_class_defs = tuple(outer_classes)
+            self.parent_class = '::'.join(
+                [klass.name for klass in self.outer_class_defs] +
+                [parent_class.name]
+            )
+            self.parent_class_def = parent_class
+            self.class_docstring = ast.get_docstring(self.parent_class_def)
+        else:
+            self.outer_class_defs = ()
+            self.parent_class = None
+            self.parent_class_def = None
+            self.class_docstring = None
+        self.testmodule = testmodule.path
+        self.module_def = testmodule
+        self.module_docstring = ast.get_docstring(self.module_def)
+        dirpath = os.path.dirname(self.testmodule)
+        self.pkginit = os.path.join(dirpath, '__init__.py')
+        self.package_inits = context.package_registry.lineage(dirpath)
+        if self.package_inits:
+            self.pkginit_docstring = self.package_inits[-1].docstring
+        else:
+            self.pkginit_docstring = None
+        self.parser = context.parser
+        self._scope_cache = context.scope_cache
+        self._parsed = None
+        self._names = None
+
+    @property
+    def pkginit_def(self):
+        """Syntax tree of the package ``__init__.py``, ``None`` if missing.
+
+        The registry doesn't keep the trees, the file is parsed again on
+        each access.
+        """
+        if not self.package_inits:
+            return None
+        with open(self.package_inits[-1].path, 'rb') as handler:
+            return ast.parse(handler.read())
+
+    @property
+    def tokens(self):
+        """Valid tokens of the test, parsed on first access."""
+        return self._parse()[0]
+
+    @property
+    def invalid_tokens(self):
+        """Invalid tokens of the test, parsed on first access."""
+        return self._parse()[1]
+
+    @property
+    def _rst_parser_messages(self):
+        """RST parser messages of the docstring, parsed on first access."""
+        return self._parse()[2]
+
+    @property
+    def token_names(self):
+        """List of the ``tokens`` keys.
+
+        Unless the docstrings are already parsed, only the token names are
+        looked for, which is cheaper, see ``DocstringParser.parse_names``.
+        """
+        if self._parsed is not None:
+            return list(self._parsed[0])
+        return list(self._scan_names()[0])
+
+    def to_record(self, names_only=False):
+        """Return a ``TestRecord`` with the extracted information.
+
+        When ``names_only`` is ``True`` the docstrings are only parsed for the
+        token names: the record tokens and invalid tokens values are ``None``
+        and it has no RST parser messages.
+        """
+        if names_only and self._parsed is None:
+            tokens, invalid_tokens = self._scan_names()
+            rst_parser_messages = []
+        else:
+            tokens, invalid_tokens, rst_parser_messages = self._parse()
+        return TestRecord(
+            self.name,
+            self.parent_class,
+            self.testmodule,
+            self.lineno,
+            self.docstring,
+            tokens,
+            invalid_tokens,
+            rst_parser_messages,
+            self.parser,
+        )
+
+    def _scopes(self):
+        """Return ``(key, docstring)`` pairs of the inherited scopes.
+
+        Scopes are ordered from the outermost package to the innermost
+        class. A key identifies the node holding the docstring by its source
+        file and line number, a module or package having no line number uses
+        ``0``.
+        """
+        scopes = [
+            ((package.path, 0), package.docstring)
+            for package in self.package_inits
+        ]
+        scopes.append(((self.testmodule, 0), self.module_docstring))
+        scopes.extend(
+            ((self.testmodule, klass.lineno), ast.get_docstring(klass))
+            for klass in self.outer_class_defs
+        )
+        if self.parent_class_def:
+            scopes.append((
+                (self.testmodule, self.parent_class_def.lineno),
+                self.class_docstring,
+            ))
+        return scopes
+
+    def _parse_scope_docstring(self, key, docstring, scope_cache,
+                               parse=None):
+        """Parse an inherited docstring once per ``key`` on ``scope_cache``.
+
+        ``parse`` defaults to ``DocstringParser.parse``, other parse methods
+        are cached under ``key`` followed by their name.
+        """
+        if parse is None:
+            parse = self.parser.parse
+        elif key is not None:
+            key = key + (parse.__name__,)
+        if scope_cache is None or key is None:
+            return parse(docstring)
+        try:
+            return scope_cache[key]
+        except KeyError:
+            result = scope_cache[key] = parse(docstring)
+            return result
+
+    def _parse(self):
+        """Return the parsed ``(tokens, invalid_tokens, messages)``, once."""
+        if self._parsed is None:
+            tokens, invalid_tokens, rst_parser_messages = (
+                self._parse_docstring(self._scope_cache))
+            decorators = self._parse_decorators()
+            if decorators:
+                tokens['decorators'] = decorators
+            self._parsed = (tokens, invalid_tokens, rst_parser_messages)
+        return self._parsed
+
+    def _parse_docstring(self, scope_cache=None):
+        """Parse module, class and function docstrings.
+
+        Package, module and class docstrings are looked up on
+        ``scope_cache`` before being parsed.
+
+        :return: A ``(tokens, invalid_tokens, rst_parser_messages)`` tuple.
+        """
+        tokens = {}
+        invalid_tokens = {}
+        rst_parser_messages = []
+        if self.docstring is None:
+            return tokens, invalid_tokens, rst_parser_messages
+
+        # Parse package, module, class and function docstrings. Every loop
+        # updates the already defined tokens and invalid_tokens. The order of
+        # processing ensures that function docstring has more priority over
+        # class, module and package docstrings respectively.
+        scopes = self._scopes() + [(None, self.docstring)]
+        docstrings = [docstring for _, docstring in scopes]
+        for key, docstring in scopes:
+            if docstring and not isinstance(docstring, type(u'')):
+                docstring = docstring.decode('utf-8')
+            scope_tokens, scope_invalid_tokens, rst_messages = (
+                self._parse_scope_docstring(key, docstring, scope_cache))
+            tokens.update(scope_tokens)
+            invalid_tokens.update(scope_invalid_tokens)
+            if docstring == docstrings[-1]:
+                rst_parser_messages = rst_messages
+
+        # Always use the first line of docstring as test case name
+        if tokens.get('test') is None:
+            if docstring and not isinstance(docstring, type(u'')):
+                docstring = self.docstring.decode('utf-8')
+            tokens['test'] = docstring.strip().split('\n')[0]
+        return tokens, invalid_tokens, rst_parser_messages
+
+    def _scan_names(self):
+        """Return the token names of the docstrings, once.
+
+        Same as ``_parse`` dicts, in the same order, but the values are
+        ``None``. Each docstring is handed to ``DocstringParser.parse_names``.
+
+        :return: A ``(tokens, invalid_tokens)`` tuple.
+        """
+        if self._names is None:
+            tokens = {}
+            invalid_tokens = {}
+            if self.docstring is not None:
+                scopes = self._scopes() + [(None, self.docstring)]
+                for key, docstring in scopes:
+                    valid, invalid = self._parse_scope_docstring(
+                        key, docstring, self._scope_cache,
+                        self.parser.parse_names)
+                    tokens.update(dict.fromkeys(valid))
+                    invalid_tokens.update(dict.fromkeys(invalid))
+                # The first line of docstring is used as test case name
+                tokens.setdefault('test')
+            if self._parse_decorators():
+                tokens['decorators'] = None
+            self._names = (tokens, invalid_tokens)
+        return self._names
+
+    def _parse_decorators(self):
+        """Get decorators from class and function definition.
+
+        Decorators of the classes enclosing a nested class come first.
+
+        Modules and packages can't be decorated, so they are skipped.
+        Decorator can be pytest marker or function call.
+
+        :return: The list of decorator names, stored as the ``decorators``
+            token when not empty.
+        """
+        token_decorators = []
+        levels = self.outer_class_defs + (
+            self.parent_class_def, self.function_def)
+        for level in levels:
+            decorators = getattr(level, 'decorator_list', None)
+            if not decorators:
+                continue
+
+            for decorator in decorators:
+                try:
+                    token_decorators.append(
+                        getattr(decorator, 'func', decorator).id
+                    )
+                except AttributeError:
+                    continue
+
+        return token_decorators
+
+
+def configure_output(json_output, markdown_output, nocolor,
+                     jsonl_output=False, validate_format=None):
+    """Set the output ``SETTINGS`` of the reports.
+
+    ``jsonl_output`` implies ``json_output``, reports listing test cases
+    print one JSON document per line instead of a single array or object.
+    ``validate_format`` is the machine readable format of the validate
+    report, one of ``VALIDATE_FORMATS``.
     """
-    SETTINGS['json'] = json_output
+    SETTINGS['json'] = json_output or jsonl_output
+    SETTINGS['jsonl'] = jsonl_output
+    SETTINGS['format'] = validate_format
     SETTINGS['markdown'] = markdown_output
     SETTINGS['nocolor'] = nocolor
 
+
+def get_report_function(report):
+    """Return the function of the ``report`` report type."""
     if report == SUMMARY_REPORT:
-        report_function = summary_report
+        return summary_report
     elif report == PRINT_REPORT:
-        report_function = print_report
+        return print_report
     elif report == VALIDATE_DOCSTRING_REPORT:
-        report_function = validate_docstring_report
-    sys.exit(report_function(get_testcases(paths)))
+        return validate_docstring_report
+    raise ValueError('Invalid report: {0}'.format(report))
+
+
+def main(report, paths, json_output, markdown_output, nocolor, jobs=1,
+         cache_dir=None, changed_files=None, watch=False, profile=False,
+         profile_output=None, jsonl_output=False, validate_format=None,
+         socket_path=None, memo_size=DEFAULT_PARSE_MEMO_SIZE):
+    """Entry point for the testimony project.
+
+    Expects a valid report type and valid directory paths, hopefully argparse
+    is taking care of validation. ``jobs`` is the number of worker processes
+    used to parse the test modules. When ``cache_dir`` is given, parsed test
+    modules are cached on that directory and the cache hit and miss counts
+    are printed on stderr. When ``changed_files`` is given, only the test
+    modules affected by those files are reported, see
+    ``get_changed_testmodules``. When ``watch`` is ``True`` the test modules
+    are reported again whenever they change, see ``testimony.watch``.
+
+    When ``profile`` is ``True`` the time spent on each stage of the run is
+    printed on stderr, see ``testimony.profiling``. When ``profile_output``
+    is given, the run is profiled by ``cProfile`` and its stats are dumped on
+    that file. Profiling parses every test module in this process, whatever
+    ``jobs`` is.
+
+    See ``configure_output`` for ``jsonl_output`` and ``validate_format``.
+
+    When ``report`` is ``SERVE_MODE``, the test modules of ``paths`` are
+    served on the ``socket_path`` Unix socket, see ``testimony.server``.
+
+    ``memo_size`` is the number of distinct docstrings whose parsing result
+    is kept, see ``DocstringParser``.
+    """
+    configure_output(json_output, markdown_output, nocolor, jsonl_output,
+                     validate_format)
+    if report == SERVE_MODE:
+        from testimony.server import serve
+        sys.exit(serve(paths, socket_path or DEFAULT_SOCKET_PATH,
+                       RunContext(memo_size=memo_size)))
+
+    report_function = get_report_function(report)
+    profiler = Profiler() if profile else None
+    cprofile = None
+    if profile_output is not None:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    if profile or cprofile is not None:
+        jobs = 1
+    # The summary only counts the token names
+    context = RunContext(
+        names_only=report_function is summary_report, profiler=profiler,
+        memo_size=memo_size)
+    if changed_files is not None:
+        with context.profiler.stage('discovery'):
+            paths = get_changed_testmodules(paths, changed_files)
+    if watch:
+        from testimony.watch import watch as watch_testcases
+        sys.exit(watch_testcases(report_function, paths, context))
+    cache = None
+    if cache_dir is not None:
+        from testimony.cache import ParseCache, UntrustedCacheError
+        try:
+            cache = ParseCache(cache_dir, context.tokens, context.names_only)
+        except UntrustedCacheError as err:
+            print('Parse cache disabled: {0}'.format(err), file=sys.stderr)
+    with context.profiler.stage('report'):
+        status = report_function(iter_testcases(paths, jobs, cache, context))
+    if cprofile is not None:
+        cprofile.disable()
+        cprofile.dump_stats(profile_output)
+    if cache is not None:
+        print('Parse cache: {0} hit(s), {1} miss(es)'.format(
+            cache.hits, cache.misses), file=sys.stderr)
+    if profiler is not None:
+        counters = [
+            ('parse memo hits', context.parser.memo_hits),
+            ('parse memo misses', context.parser.memo_misses),
+        ]
+        if cache is not None:
+            counters.extend([
+                ('parse cache hits', cache.hits),
+                ('parse cache misses', cache.misses),
+            ])
+        profiler.report(sys.stderr, SETTINGS['json'], counters)
+    sys.exit(status)
+
+
+def text_writer(stream=None):
+    """Return the writer of the text reports, see ``testimony.output``.
+
+    Whether the text is colored is resolved once, when the writer is
+    created, see ``colored``.
+    """
+    termcolor = get_termcolor()
+    if termcolor is not None:
+        return TextWriter(stream, termcolor.colored)
+    return TextWriter(stream)
+
+
+def validate_format_writer(stream=None):
+    """Return the writer of ``SETTINGS['format']`` or ``None``.
+
+    The JUnit and SARIF writers write the validate report results in machine
+    readable formats, see ``testimony.output``.
+    """
+    if SETTINGS['format'] == JUNIT_FORMAT:
+        return JUnitWriter(stream)
+    if SETTINGS['format'] == SARIF_FORMAT:
+        return SARIFWriter(stream, ISSUE_CATEGORIES)
+    return None
+
+
+def json_writer(stream=None):
+    """Return the JSON writer of the reports listing test cases.
+
+    Items are written as a JSON array, or one per line when
+    ``SETTINGS['jsonl']`` is set, see ``testimony.output``.
+    """
+    if SETTINGS['jsonl']:
+        return JSONLinesWriter(stream)
+    return JSONArrayWriter(stream)
 
 
 def print_markdown(testcases):
     """Print markdown formatted list of test cases.
 
     :param testcases: A dict where the key is a path and value is a list of
-        found testcases on that path.
+        found testcases on that path, or an iterable of ``(path, tests)``
+        pairs. Each path is printed as soon as it is iterated.
     """
-    result = {}
-    for path, tests in testcases.items():
-        result[path] = [test.to_dict() for test in tests]
+    for path, tests in iter_items(testcases):
         print('# {0}\n\n'.format(
             colored(path, attrs=['bold'])))
         if len(tests) == 0:
@@ -330,58 +902,60 @@ def print_report(testcases):
     """Print the list of test cases.
 
     :param testcases: A dict where the key is a path and value is a list of
-        found testcases on that path.
+        found testcases on that path, or an iterable of ``(path, tests)``
+        pairs. Each path is printed as soon as it is iterated.
     """
     if SETTINGS['json']:
-        result = []
-        for path, tests in testcases.items():
-            for test in tests:
-                test_dict = test.to_dict()
-                test_data = test_dict['tokens']
-                testimony_metadata = {}
-                testimony_metadata['file-path'] = path
-                testimony_metadata['test-class'] = test.parent_class
-                testimony_metadata['test-name'] = test.name
-                testimony_metadata['invalid-tokens'] = test_dict[
-                    'invalid-tokens']
-                testimony_metadata['rst-parse-messages'] = test_dict[
-                    'rst-parse-messages']
-                test_data['_testimony'] = testimony_metadata
-                result.append(test_data)
-
-        print(json.dumps(result))
+        # Each test case is written as soon as it is encoded
+        with json_writer() as writer:
+            for path, tests in iter_items(testcases):
+                for test in tests:
+                    test_dict = test.to_dict()
+                    test_data = test_dict['tokens']
+                    testimony_metadata = {}
+                    testimony_metadata['file-path'] = path
+                    testimony_metadata['test-class'] = test.parent_class
+                    testimony_metadata['test-name'] = test.name
+                    testimony_metadata['invalid-tokens'] = test_dict[
+                        'invalid-tokens']
+                    testimony_metadata['rst-parse-messages'] = test_dict[
+                        'rst-parse-messages']
+                    test_data['_testimony'] = testimony_metadata
+                    writer.write(test_data)
         return 0
 
     if SETTINGS['markdown']:
         return print_markdown(testcases)
 
-    result = {}
-    for path, tests in testcases.items():
-        result[path] = [test.to_dict() for test in tests]
-        print('{0}\n{1}\n'.format(
-            colored(path, attrs=['bold']), '=' * len(path)))
-        if len(tests) == 0:
-            print('No test cases found.\n')
-        for test in tests:
-            title = testcase_title(test)
-            print('{0}\n{1}\n\n{2}\n'.format(
-                title, '-' * len(title), test))
+    with text_writer() as writer:
+        for path, tests in iter_items(testcases):
+            writer.write('{0}\n{1}\n\n'.format(
+                writer.colored(path, attrs=['bold']), '=' * len(path)))
+            if len(tests) == 0:
+                writer.write('No test cases found.\n\n')
+            for test in tests:
+                title = testcase_title(test)
+                writer.write('{0}\n{1}\n\n{2}\n\n'.format(
+                    title, '-' * len(title), test))
+            writer.end_block()
 
 
 def summary_report(testcases):
-    """Summary about the test cases report."""
+    """Summary about the test cases report.
+
+    The counters are updated as ``testcases`` is iterated, see
+    ``print_report`` for the accepted values.
+    """
     count = no_docstring = 0
     tokens_count = collections.defaultdict(lambda: 0)
-    for testcase in itertools.chain(*testcases.values()):
-        count += 1
-        if testcase.docstring is None:
-            no_docstring += 1
-        for token in testcase.tokens.keys():
-            tokens_count[token] += 1
-
-    def percentage(value):
-        """Calculate the percentage of the value on the total."""
-        return value / float(count) * 100
+    for _, tests in iter_items(testcases):
+        for testcase in tests:
+            count += 1
+            if testcase.docstring is None:
+                no_docstring += 1
+            for token in testcase.tokens.keys():
+                tokens_count[token] += 1
+
     summary_result = {
         'count': count,
         'no_docstring': no_docstring,
@@ -410,20 +984,31 @@ def summary_report(testcases):
         PRINT_NO_DOC,
         ' ' * (column_size - len(PRINT_NO_DOC) + 2),
         no_docstring,
-        percentage(no_docstring)
+        percentage(no_docstring, count)
     ))
     for token, value in sorted(tokens_count.items()):
         print(value_fmt.format(
             token.capitalize(),
             ' ' * (column_size - len(token) + 2),
             value,
-            percentage(value)
+            percentage(value, count)
         ))
 
 
 def validate_docstring_report(testcases):
-    """Check for presence of invalid docstrings report."""
+    """Check for presence of invalid docstrings report.
+
+    Unless the JSON output is requested, the issues of each path are printed
+    as soon as it is iterated, see ``print_report`` for the accepted values.
+    With ``SETTINGS['jsonl']`` the issues of each invalid test case are
+    printed as a JSON line as soon as its path is iterated. With
+    ``SETTINGS['format']`` the results of each path are printed as soon as
+    it is iterated in that machine readable format, see
+    ``validate_format_writer``.
+    """
     result = {}
+    output_writer = validate_format_writer()
+    lines_writer = JSONLinesWriter() if SETTINGS['jsonl'] else None
     invalid_docstring_count = 0
     invalid_tags_docstring_count = 0
     minimum_docstring_count = 0
@@ -431,94 +1016,140 @@ def validate_docstring_report(testcases):
     invalid_token_value_count = 0
     rst_parsing_issue_count = 0
     testcase_count = 0
-    for path, tests in testcases.items():
-        testcase_count += len(tests)
-        for testcase in tests:
-            issues = []
-            if not testcase.docstring:
-                issues.append('Missing docstring.')
-                missing_docstring_count += 1
-            if not testcase.has_minimum_tokens:
-                issues.append(
-                    'Docstring should have at least {} token(s)'.format(
-                        ', '.join(sorted(testcase.parser.minimum_tokens))
-                    )
-                )
-                minimum_docstring_count += 1
-            if testcase.has_parsing_issues:
-                issues.append(
-                    'Docstring has RST parsing issues. {0}'
-                    .format(testcase.rst_parser_messages)
-                )
-                rst_parsing_issue_count += 1
-            if testcase.invalid_tokens:
-                issues.append('Unexpected tokens:\n{0}'.format(
-                    indent(
-                        '\n'.join([
-                            '{0}: {1}'.format(key.capitalize(), value)
-                            for key, value in
-                            sorted(testcase.invalid_tokens.items())
-                        ]),
-                        '  '
-                    )
-                ))
-                invalid_tags_docstring_count += 1
-
-            invalid_token_values = {}
-            for token, value in testcase.tokens.items():
-                if token not in SETTINGS['tokens']:
-                    continue
-                if not SETTINGS['tokens'][token].validate(value):
-                    invalid_token_values.setdefault(token, value)
-            if invalid_token_values:
-                invalid_token_strings = []
-                for key, value in sorted(invalid_token_values.items()):
-                    settings_token = SETTINGS['tokens'][key]
-                    # TODO: Rework constants to not compare bare string
-                    if settings_token.token_type == 'choice':
-                        valid_choices_string = '\n    choices: {}'.format(
-                            settings_token.choices
-                        )
-                    else:
-                        valid_choices_string = ''
-                    invalid_token_strings.append(
-                        '{token}: {value}'
-                        '\n    type: {type}'
-                        '\n    case sensitive: {sensitive}'
-                        '{choices}'.format(
-                            token=key.capitalize(),
-                            value=value,
-                            type=settings_token.token_type,
-                            sensitive=settings_token.casesensitive,
-                            choices=valid_choices_string,
+    # Look the compiled validators up once for the whole report
+    validators = {
+        name: token.validator for name, token in SETTINGS['tokens'].items()}
+    with text_writer() as writer:
+        for path, tests in iter_items(testcases):
+            testcase_count += len(tests)
+            path_result = collections.OrderedDict()
+            module_results = []
+            for testcase in tests:
+                issues = []
+                if not testcase.docstring:
+                    issues.append(
+                        (ISSUE_MISSING_DOCSTRING, 'Missing docstring.'))
+                    missing_docstring_count += 1
+                if not testcase.has_minimum_tokens:
+                    issues.append((
+                        ISSUE_MINIMUM_TOKENS,
+                        'Docstring should have at least {} token(s)'.format(
+                            ', '.join(sorted(testcase.parser.minimum_tokens))
+                        ),
+                    ))
+                    minimum_docstring_count += 1
+                if testcase.has_parsing_issues:
+                    issues.append((
+                        ISSUE_RST_PARSING,
+                        'Docstring has RST parsing issues. {0}'
+                        .format(testcase.rst_parser_messages),
+                    ))
+                    rst_parsing_issue_count += 1
+                if testcase.invalid_tokens:
+                    issues.append((
+                        ISSUE_UNEXPECTED_TOKENS,
+                        'Unexpected tokens:\n{0}'.format(indent(
+                            '\n'.join([
+                                '{0}: {1}'.format(key.capitalize(), value)
+                                for key, value in
+                                sorted(testcase.invalid_tokens.items())
+                            ]),
+                            '  '
+                        )),
+                    ))
+                    invalid_tags_docstring_count += 1
+
+                invalid_token_values = {}
+                for token, value in testcase.tokens.items():
+                    validator = validators.get(token)
+                    if validator is not None and not validator(value):
+                        invalid_token_values.setdefault(token, value)
+                if invalid_token_values:
+                    invalid_token_strings = []
+                    for key, value in sorted(invalid_token_values.items()):
+                        settings_token = SETTINGS['tokens'][key]
+                        # TODO: Rework constants to not compare bare string
+                        token_type = settings_token.token_type
+                        if token_type in ('choice', 'list'):
+                            constraint_string = '\n    choices: {}'.format(
+                                settings_token.choices
+                            )
+                        elif token_type == 'regex':
+                            constraint_string = '\n    pattern: {}'.format(
+                                settings_token.pattern
+                            )
+                        elif token_type == 'url':
+                            constraint_string = '\n    schemes: {}'.format(
+                                settings_token.schemes
+                            )
+                        else:
+                            constraint_string = ''
+                        invalid_token_strings.append(
+                            '{token}: {value}'
+                            '\n    type: {type}'
+                            '\n    case sensitive: {sensitive}'
+                            '{constraint}'.format(
+                                token=key.capitalize(),
+                                value=value,
+                                type=token_type,
+                                sensitive=settings_token.casesensitive,
+                                constraint=constraint_string,
+                            )
                         )
-                    )
 
-                issues.append('Tokens with invalid values:\n{0}'.format(
-                    indent(
-                        '\n'.join(invalid_token_strings),
-                        '  ',
-                    )
+                    issues.append((
+                        ISSUE_INVALID_TOKEN_VALUES,
+                        'Tokens with invalid values:\n{0}'.format(indent(
+                            '\n'.join(invalid_token_strings),
+                            '  ',
+                        )),
+                    ))
+                    invalid_token_value_count += 1
+
+                if issues:
+                    path_result[testcase_title(testcase)] = [
+                        message for _, message in issues]
+                    invalid_docstring_count += 1
+                if output_writer is not None:
+                    module_results.append((testcase, issues))
+
+            if output_writer is not None:
+                if module_results:
+                    output_writer.write_module(path, module_results)
+                continue
+            if not path_result:
+                continue
+            if lines_writer is not None:
+                for testcase, issues in path_result.items():
+                    lines_writer.write({
+                        'file-path': path,
+                        'test': testcase,
+                        'issues': issues,
+                    })
+                continue
+            if SETTINGS['json']:
+                result[path] = path_result
+                continue
+            writer.write('{0}\n{1}\n\n'.format(path, '=' * len(path)))
+            for testcase, issues in path_result.items():
+                writer.write('{0}\n{1}\n\n{2}\n\n'.format(
+                    testcase,
+                    '-' * len(testcase),
+                    '\n'.join(['* {0}'.format(issue) for issue in issues]),
                 ))
-                invalid_token_value_count += 1
-
-            if issues:
-                title = testcase_title(testcase)
-                result.setdefault(
-                    path, collections.OrderedDict())[title] = issues
-                invalid_docstring_count += 1
+            writer.end_block()
 
+    if output_writer is not None:
+        output_writer.close()
+        if invalid_docstring_count > 0:
+            return -1
+        return
+    if lines_writer is not None:
+        return
     if SETTINGS['json']:
         print(json.dumps(result))
         return
 
-    for path, testcases in result.items():
-        print('{0}\n{1}\n'.format(path, '=' * len(path)))
-        for testcase, issues in testcases.items():
-            print('{0}\n{1}\n'.format(testcase, '-' * len(testcase)))
-            print(
-                '\n'.join(['* {0}'.format(issue) for issue in issues]) + '\n')
-
     if invalid_docstring_count == 0:
         color = CLR_GOOD
     else:
@@ -530,7 +1161,7 @@ def validate_docstring_report(testcases):
     print('{}: {} ({:05.02f}%)'.format(
         PRINT_INVALID_DOC,
         colored(invalid_docstring_count, color, attrs=['bold']),
-        float(invalid_docstring_count)/testcase_count * 100
+        percentage(invalid_docstring_count, testcase_count)
     ))
     if missing_docstring_count == 0:
         color = CLR_GOOD
@@ -539,7 +1170,7 @@ def validate_docstring_report(testcases):
     print('{}: {} ({:.02f}%)'.format(
         PRINT_NO_DOC.strip(),
         colored(missing_docstring_count, color, attrs=['bold']),
-        float(missing_docstring_count)/testcase_count * 100
+        percentage(missing_docstring_count, testcase_count)
     ))
     if minimum_docstring_count == 0:
         color = CLR_GOOD
@@ -548,7 +1179,7 @@ def validate_docstring_report(testcases):
     print('{}: {} ({:.02f}%)'.format(
         PRINT_NO_MINIMUM_DOC_TC,
         colored(minimum_docstring_count, color, attrs=['bold']),
-        float(minimum_docstring_count)/testcase_count * 100
+        percentage(minimum_docstring_count, testcase_count)
     ))
     if invalid_tags_docstring_count == 0:
         color = CLR_GOOD
@@ -557,7 +1188,7 @@ def validate_docstring_report(testcases):
     print('{}: {} ({:.02f}%)'.format(
         PRINT_UNEXPECTED_DOC_TC,
         colored(invalid_tags_docstring_count, color, attrs=['bold']),
-        float(invalid_tags_docstring_count)/testcase_count * 100
+        percentage(invalid_tags_docstring_count, testcase_count)
     ))
     if invalid_token_value_count == 0:
         color = CLR_GOOD
@@ -566,7 +1197,7 @@ def validate_docstring_report(testcases):
     print('{}: {} ({:.02f}%)'.format(
         PRINT_INVALID_VALUE,
         colored(invalid_token_value_count, color, attrs=['bold']),
-        float(invalid_token_value_count)/testcase_count * 100
+        percentage(invalid_token_value_count, testcase_count)
     ))
     if rst_parsing_issue_count == 0:
         color = CLR_GOOD
@@ -575,18 +1206,18 @@ def validate_docstring_report(testcases):
     print('{}: {} ({:.02f}%)'.format(
         PRINT_RST_PARSING_ISSUE.strip(),
         colored(rst_parsing_issue_count, color, attrs=['bold']),
-        float(rst_parsing_issue_count)/testcase_count * 100
+        percentage(rst_parsing_issue_count, testcase_count)
     ))
 
-    if len(result) > 0:
+    if invalid_docstring_count > 0:
         return -1
 
 
-def get_testcases(paths):
-    """Walk each path in ``paths`` and return the test cases found.
+def get_testmodules(paths):
+    """Walk each path in ``paths`` and return the test modules found.
 
-    :param path: List o directories to find test modules and test cases.
-    :return: A dict mapping a test module path and its test cases.
+    :param path: List o directories or files to find test modules.
+    :return: A list of test module paths, without duplicates.
     """
     testmodules = []
     for path in paths:
@@ -594,36 +1225,300 @@ def get_testcases(paths):
             if is_test_module(os.path.basename(path)):
                 testmodules.append(path)
             continue
-        for dirpath, _, filenames in os.walk(path):
-            for filename in filenames:
-                if is_test_module(filename):
-                    testmodules.append(os.path.join(dirpath, filename))
-    testcases = collections.OrderedDict()
-    for testmodule in testmodules:
-        testcases[testmodule] = []
+        for _, found in walk_testmodules(path):
+            testmodules.extend(found)
+    return list(collections.OrderedDict.fromkeys(testmodules))
+
+
+def get_changed_testmodules(paths, changed_files):
+    """Return the test modules of ``paths`` affected by ``changed_files``.
+
+    A changed test module is affected, and so are the test modules next to a
+    changed ``__init__.py`` since they inherit its docstring. Changed files
+    outside of ``paths``, excluded or which no longer exist are ignored.
+    Unlike ``get_testmodules`` the paths are not walked.
+
+    :param paths: List of directories or files to restrict the result to.
+    :param changed_files: Iterable of changed file paths.
+    :return: A list of test module paths, without duplicates.
+    """
+    roots = [os.path.abspath(path) for path in paths]
+    testmodules = []
+    for changed_file in changed_files:
+        abspath = os.path.abspath(changed_file)
+        root = next((
+            root for root in roots
+            if abspath == root or abspath.startswith(root + os.sep)
+        ), None)
+        if root is None or not os.path.isfile(abspath):
+            continue
+        relpath = os.path.relpath(abspath, root)
+        parts = relpath.split(os.sep)
+        if abspath != root and any(
+                is_excluded(os.path.join(*parts[:index]), root)
+                for index in range(1, len(parts) + 1)):
+            continue
+        dirpath, filename = os.path.split(changed_file)
+        if filename == '__init__.py':
+            reldirpath = os.path.dirname(relpath)
+            testmodules.extend(
+                os.path.join(dirpath, sibling)
+                for sibling in sorted(os.listdir(dirpath or os.curdir))
+                if is_test_module(sibling) and
+                not is_excluded(os.path.join(reldirpath, sibling), root) and
+                os.path.isfile(os.path.join(dirpath, sibling))
+            )
+        elif is_test_module(filename):
+            testmodules.append(changed_file)
+    return list(collections.OrderedDict.fromkeys(testmodules))
+
+
+class TestCollector(ast.NodeVisitor):
+    """Collect the test functions of a module syntax tree in a single pass.
+
+    Test functions, including ``async def`` ones, are found on the module and
+    on classes at any nesting level, also when defined on ``if``, ``try``,
+    ``with`` or loop blocks. Only statement lists are walked and function
+    bodies are skipped, so each statement is visited at most once.
+
+    After ``visit``, ``tests`` holds a ``(function_def, classes)`` pair for
+    each test function in source order, ``classes`` being the tuple of
+    enclosing class definitions from the outermost one.
+    """
+
+    #: Fields of the nodes which hold statements
+    STATEMENT_FIELDS = ('body', 'handlers', 'orelse', 'finalbody', 'cases')
+
+    def __init__(self):
+        """Initialize a collector without any test found."""
+        self.tests = []
+        self._classes = []
+
+    def generic_visit(self, node):
+        """Visit the statements nested in ``node``, skipping expressions."""
+        for field in self.STATEMENT_FIELDS:
+            for child in getattr(node, field, ()):
+                self.visit(child)
+
+    def visit_ClassDef(self, node):
+        """Visit the class body with the class on the nesting chain."""
+        self._classes.append(node)
+        self.generic_visit(node)
+        self._classes.pop()
+
+    def visit_FunctionDef(self, node):
+        """Collect ``node`` if it is a test function, skip its body."""
+        if node.name.startswith('test_'):
+            self.tests.append((node, tuple(self._classes)))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+
+# Bytes any test function definition contains, ``async def`` included
+_TEST_DEF_RE = re.compile(br'\bdef[\s\\]+test_')
+
+
+def may_have_testcases(testmodule):
+    """Indicate if ``testmodule`` may define test functions.
+
+    The file content is memory mapped and scanned for a ``def test_``
+    definition, it is not parsed. A ``False`` result means the module has no
+    test cases, but a ``True`` result can come from a comment or a string.
+    """
+    with open(testmodule, 'rb') as handler:
+        try:
+            data = mmap.mmap(handler.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            return False
+        with data:
+            return _TEST_DEF_RE.search(data) is not None
+
+
+def get_module_testcases(testmodule, context=None):
+    """Parse ``testmodule`` and return the list of test cases found.
+
+    The test cases are returned as ``TestRecord`` instances, so the syntax
+    tree of the module is freed once this function returns. Modules which
+    can't define test functions are not parsed, see ``may_have_testcases``.
+    When the ``context`` has ``names_only`` set, the records only have the
+    token names, see ``TestFunction.to_record``.
+
+    :param testmodule: Path of the test module.
+    :param context: Optional ``RunContext`` shared between modules of a run.
+    """
+    if context is None:
+        context = RunContext()
+    profiler = context.profiler
+    with profiler.stage('prescan'):
+        if not may_have_testcases(testmodule):
+            return []
+    with profiler.stage('read'):
         with open(testmodule) as handler:
-            root = ast.parse(handler.read())
-            root.path = testmodule
-            for node in ast.iter_child_nodes(root):
-                if isinstance(node, ast.ClassDef):
-                    testcases[testmodule].extend([
-                        TestFunction(subnode, node, root)
-                        for subnode in ast.iter_child_nodes(node)
-                        if isinstance(subnode, ast.FunctionDef) and
-                        subnode.name.startswith('test_')
-                    ])
-                elif (isinstance(node, ast.FunctionDef) and
-                      node.name.startswith('test_')):
-                    # Module's test functions
-                    testcases[testmodule].append(
-                        TestFunction(node, testmodule=root)
-                    )
+            source = handler.read()
+    with profiler.stage('ast parse'):
+        root = ast.parse(source)
+    root.path = testmodule
+    with profiler.stage('extraction'):
+        collector = TestCollector()
+        collector.visit(root)
+        testcases = [
+            TestFunction(
+                function_def,
+                classes[-1] if classes else None,
+                root,
+                context,
+                classes[:-1],
+            ).to_record(context.names_only)
+            for function_def, classes in collector.tests
+        ]
     return testcases
 
 
+_WORKER_STATE = {}
+
+
+def _init_worker(tokens, names_only=False,
+                 memo_size=DEFAULT_PARSE_MEMO_SIZE):
+    """Set up a worker process used by ``get_testcases``."""
+    _WORKER_STATE['context'] = RunContext(
+        tokens, names_only, memo_size=memo_size)
+
+
+def _get_module_testcases_worker(testmodule):
+    """Call ``get_module_testcases`` with the worker process context."""
+    return get_module_testcases(testmodule, _WORKER_STATE['context'])
+
+
+def iter_testcases(paths, jobs=1, cache=None, context=None):
+    """Walk each path in ``paths`` and yield the test cases found.
+
+    Test modules are parsed lazily, in the order they are found, so the test
+    cases of a module are available before the next modules are parsed.
+
+    :param path: List o directories to find test modules and test cases.
+    :param jobs: Number of worker processes used to parse the test modules.
+        When greater than one, modules are parsed by a process pool, a few
+        modules ahead of the one being yielded.
+    :param cache: Optional ``testimony.cache.ParseCache``. Test modules with a
+        fresh cache entry are not parsed.
+    :param context: Optional ``RunContext``, a new one is created from
+        ``SETTINGS`` when it is not provided.
+    :return: A generator of ``(test module path, test cases)`` tuples, test
+        cases being ``TestRecord`` instances.
+    """
+    if context is None:
+        context = RunContext()
+    profiler = context.profiler
+    with profiler.stage('discovery'):
+        testmodules = get_testmodules(paths)
+    executor = None
+    if jobs > 1 and len(testmodules) > 1:
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(testmodules)),
+            initializer=_init_worker,
+            initargs=(
+                context.tokens, context.names_only, context.parser.memo_size),
+        )
+    # Modules whose test cases are not yielded yet, either as a list of test
+    # cases or as a future when parsed by the process pool
+    pending = collections.deque()
+    try:
+        for testmodule in testmodules:
+            tests = None
+            if cache is not None:
+                with profiler.stage('cache'):
+                    tests = cache.get(testmodule)
+            if tests is None:
+                if executor is None:
+                    tests = get_module_testcases(testmodule, context)
+                    if cache is not None:
+                        with profiler.stage('cache'):
+                            cache.set(testmodule, tests)
+                else:
+                    tests = executor.submit(
+                        _get_module_testcases_worker, testmodule)
+            pending.append((testmodule, tests))
+            while pending and (
+                    executor is None or len(pending) > jobs * 4):
+                yield _resolve_pending(pending.popleft(), cache)
+        while pending:
+            yield _resolve_pending(pending.popleft(), cache)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _resolve_pending(item, cache):
+    """Return the ``(path, tests)`` pair of an ``iter_testcases`` item.
+
+    Wait for the test cases when they are parsed by the process pool, given
+    as a future instead of a list, and store them on ``cache``.
+    """
+    testmodule, tests = item
+    if not isinstance(tests, list):
+        tests = tests.result()
+        if cache is not None:
+            cache.set(testmodule, tests)
+    return testmodule, tests
+
+
+def get_testcases(paths, jobs=1, cache=None, context=None):
+    """Walk each path in ``paths`` and return the test cases found.
+
+    See ``iter_testcases`` for the parameters.
+
+    :return: A dict mapping a test module path and its test cases.
+    """
+    return collections.OrderedDict(
+        iter_testcases(paths, jobs, cache, context))
+
+
+@functools.lru_cache(maxsize=None)
+def _import_termcolor():
+    """Import and return ``termcolor``, or ``None`` if it isn't installed."""
+    try:
+        import termcolor
+    except ImportError:
+        return None
+    return termcolor
+
+
+def __getattr__(name):
+    """Return the ``HAS_TERMCOLOR`` and ``termcolor`` compatibility names.
+
+    ``termcolor`` is no longer imported with the package, those names are
+    computed on first access and then kept on the module.
+    """
+    if name in ('HAS_TERMCOLOR', 'termcolor'):
+        module = _import_termcolor()
+        globals()['HAS_TERMCOLOR'] = module is not None
+        if module is not None:
+            globals()['termcolor'] = module
+            return globals()[name]
+        if name == 'HAS_TERMCOLOR':
+            return False
+    raise AttributeError(
+        'module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+def get_termcolor():
+    """Return the ``termcolor`` module when the output is colored.
+
+    ``None`` is returned when ``SETTINGS['nocolor']`` is set, when
+    ``termcolor`` is not installed or when ``HAS_TERMCOLOR`` was set to
+    ``False``. It is only imported for colored output.
+    """
+    if SETTINGS['nocolor'] or not globals().get('HAS_TERMCOLOR', True):
+        return None
+    return _import_termcolor()
+
+
 def colored(text, color=None, attrs=None):
     """Use termcolor.colored if available otherwise return the same string."""
-    if HAS_TERMCOLOR and not SETTINGS['nocolor']:
+    termcolor = get_termcolor()
+    if termcolor is not None:
         return termcolor.colored(text, color=color, attrs=attrs)
     else:
         return text
@@ -0,0 +1,175 @@
+# coding=utf-8
+"""On-disk cache of the test cases extracted from test modules."""
+import hashlib
+import os
+import pickle
+import stat
+import subprocess
+import tempfile
+
+# Bump whenever the pickled ``TestRecord`` state or the way test cases are
+# found or their docstrings parsed on a module changes
+CACHE_VERSION = 5
+
+
+def file_signature(path):
+    """Return ``(mtime_ns, size)`` of ``path`` or ``None`` if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_digest(path):
+    """Return the sha1 hex digest of the content of ``path``."""
+    with open(path, 'rb') as handler:
+        return hashlib.sha1(handler.read()).hexdigest()
+
+
+def tokens_fingerprint(tokens, names_only=False):
+    """Return a digest identifying the effective ``tokens`` configuration.
+
+    Only the token names and whether they are required change the extracted
+    information, value validation happens when reporting. Test cases with
+    only the token names, see ``RunContext``, get another fingerprint.
+    """
+    config = sorted(
+        (name, bool(token.required)) for name, token in tokens.items())
+    if names_only:
+        config.append('names-only')
+    return hashlib.sha1(repr(config).encode('utf-8')).hexdigest()
+
+
+class UntrustedCacheError(Exception):
+    """Raised when the entries of a cache directory may not be ours."""
+
+
+def check_directory(directory):
+    """Ensure that only the current user could write the ``directory`` entries.
+
+    Cache entries are unpickled, which can run arbitrary code, so a
+    directory owned by another user, writable by everyone or tracked by git,
+    as a repository could ship it, is refused.
+
+    :raises UntrustedCacheError: When the directory is not trusted.
+    """
+    info = os.stat(directory)
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise UntrustedCacheError(
+            '{0} is owned by another user'.format(directory))
+    if info.st_mode & stat.S_IWOTH:
+        raise UntrustedCacheError(
+            '{0} is writable by everyone'.format(directory))
+    try:
+        tracked = subprocess.run(
+            ['git', 'ls-files', '--', '.'],
+            cwd=directory,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout
+    except OSError:
+        # No git, nothing can be tracked
+        tracked = ''
+    if tracked.strip():
+        raise UntrustedCacheError(
+            '{0} has files tracked by git'.format(directory))
+
+
+class ParseCache(object):
+    """Cache of the test cases of each test module, stored on ``directory``.
+
+    An entry is keyed by the test module path and the ``tokens`` configuration
+    fingerprint, see ``tokens_fingerprint`` for ``names_only``. It records
+    the ``(mtime_ns, size)`` signature and the content digest of the module
+    and of its package ``__init__.py``: an entry is fresh when every
+    signature matches, or when the sizes match and the content digests are
+    the same. In the latter case the entry is written again with the new
+    signatures, so the content isn't hashed again on the next runs.
+
+    ``hits`` and ``misses`` count the lookups done with ``get``.
+    """
+
+    def __init__(self, directory, tokens, names_only=False):
+        """Initialize the cache, creating ``directory`` if needed.
+
+        :raises UntrustedCacheError: When the entries of ``directory`` could
+            come from someone else, see ``check_directory``.
+        """
+        self.directory = directory
+        self.fingerprint = tokens_fingerprint(tokens, names_only)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_directory(directory)
+
+    @staticmethod
+    def dependencies(testmodule):
+        """Return the files whose content affects ``testmodule`` test cases."""
+        return [
+            testmodule,
+            os.path.join(os.path.dirname(testmodule), '__init__.py'),
+        ]
+
+    def _entry_path(self, testmodule):
+        """Return the path of the cache entry of ``testmodule``."""
+        key = '{0}\0{1}\0{2}'.format(
+            CACHE_VERSION, self.fingerprint, os.path.abspath(testmodule))
+        return os.path.join(
+            self.directory,
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pickle',
+        )
+
+    @staticmethod
+    def _is_fresh(path, current, signature, digest):
+        """Indicate if ``path`` still matches its recorded state.
+
+        ``current`` is the current signature of ``path``.
+        """
+        if current is None or signature is None:
+            return current == signature
+        if current == signature:
+            return True
+        return current[1] == signature[1] and file_digest(path) == digest
+
+    def get(self, testmodule):
+        """Return the cached test cases of ``testmodule`` or ``None``."""
+        try:
+            with open(self._entry_path(testmodule), 'rb') as handler:
+                entry = pickle.load(handler)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        dependencies = []
+        for path, signature, digest in entry['dependencies']:
+            current = file_signature(path)
+            if not self._is_fresh(path, current, signature, digest):
+                self.misses += 1
+                return None
+            dependencies.append((path, current, digest))
+        self.hits += 1
+        if dependencies != entry['dependencies']:
+            # Fresh from the digests, record the new signatures
+            entry['dependencies'] = dependencies
+            self._write(testmodule, entry)
+        return entry['testcases']
+
+    def set(self, testmodule, testcases):
+        """Store ``testcases`` as the test cases of ``testmodule``."""
+        dependencies = []
+        for path in self.dependencies(testmodule):
+            signature = file_signature(path)
+            digest = file_digest(path) if signature is not None else None
+            dependencies.append((path, signature, digest))
+        self._write(
+            testmodule, {'dependencies': dependencies, 'testcases': testcases})
+
+    def _write(self, testmodule, entry):
+        """Write ``entry`` as the cache entry of ``testmodule``."""
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as handler:
+            pickle.dump(entry, handler, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._entry_path(testmodule))
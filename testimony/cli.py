@@ -1,5 +1,8 @@
 # coding=utf-8
 """Testimony CLI utilities."""
+import os
+import subprocess
+
 import click
 
 from testimony import SETTINGS, config, constants, main
@@ -7,7 +10,14 @@ from testimony import SETTINGS, config, constants, main
 
 @click.command()
 @click.option('-j', '--json', help='JSON output', is_flag=True)
+@click.option(
+    '--jsonl', help='Newline delimited JSON output, one test case per line',
+    is_flag=True)
 @click.option('-m', '--markdown', help='markdown output', is_flag=True)
+@click.option(
+    '--format', 'validate_format',
+    type=click.Choice(constants.VALIDATE_FORMATS),
+    help='Machine readable format of the validate report')
 @click.option('-n', '--nocolor', default=False, help='Color output',
               is_flag=True)
 @click.option('--tokens', help='Comma separated list of expected tokens')
@@ -16,12 +26,84 @@ from testimony import SETTINGS, config, constants, main
 @click.option(
     '-c', '--config', 'config_file', type=click.File(),
     help='Configuration file (YAML)')
-@click.argument('report', type=click.Choice(constants.REPORT_TAGS))
-@click.argument('path', nargs=-1, type=click.Path(exists=True))
+@click.option(
+    '--jobs', type=click.IntRange(min=1),
+    help='Number of processes used to parse test modules (default: CPU count)')
+@click.option(
+    '--memo-size', type=click.IntRange(min=0),
+    help='Number of distinct docstrings whose parsing result is kept in '
+    'memory, 0 to disable it (default: {0})'.format(
+        constants.DEFAULT_PARSE_MEMO_SIZE))
+@click.option(
+    '--cache', 'use_cache', is_flag=True,
+    help='Cache parsed test modules between runs')
+@click.option(
+    '--cache-dir', type=click.Path(file_okay=False),
+    help='Cache directory, implies --cache (default: {0})'.format(
+        constants.DEFAULT_CACHE_DIR))
+@click.option(
+    '--changed-since', metavar='REF',
+    help='Only report test modules changed since this git reference')
+@click.option(
+    '--changed-files', type=click.File(),
+    help='Only report test modules listed on this file, one per line, '
+    'use - for stdin')
+@click.option(
+    '--include', multiple=True, metavar='GLOB',
+    help='Test module file name pattern, can be repeated (default: {0})'
+    .format(', '.join(constants.DEFAULT_TEST_MODULE_PATTERNS)))
+@click.option(
+    '--exclude', multiple=True, metavar='GLOB',
+    help='File or directory name or path pattern to skip, can be repeated, '
+    'in addition to {0}'.format(', '.join(constants.DEFAULT_EXCLUDE_PATTERNS)))
+@click.option(
+    '--profile', is_flag=True,
+    help='Print the time spent on each stage on stderr, as JSON with --json')
+@click.option(
+    '--profile-output', type=click.Path(dir_okay=False, writable=True),
+    help='Dump the cProfile stats of the run on this file')
+@click.option(
+    '--socket', 'socket_path', type=click.Path(dir_okay=False),
+    help='Unix socket of testimony serve (default: {0})'.format(
+        constants.DEFAULT_SOCKET_PATH))
+@click.argument(
+    'report',
+    type=click.Choice(constants.REPORT_TAGS + (
+        constants.WATCH_MODE, constants.SERVE_MODE)))
+@click.argument('path', nargs=-1, type=click.Path())
 def testimony(
-        json, markdown, nocolor, tokens, minimum_tokens, config_file,
-        report, path):
-    """Inspect and report on the Python test cases."""
+        json, jsonl, markdown, validate_format, nocolor, tokens,
+        minimum_tokens, config_file, jobs, memo_size, use_cache, cache_dir,
+        changed_since, changed_files, include, exclude, profile,
+        profile_output, socket_path, report, path):
+    """Inspect and report on the Python test cases.
+
+    Use ``testimony watch REPORT PATH...`` to report again the test cases
+    whenever their test modules change.
+
+    Use ``testimony serve PATH...`` to keep the test cases parsed and answer
+    the reports requested by ``testimony-client``.
+    """
+    watch = report == constants.WATCH_MODE
+    if watch:
+        if not path or path[0] not in constants.REPORT_TAGS:
+            raise click.BadParameter(
+                'watch expects one of {0} before the paths'.format(
+                    ', '.join(constants.REPORT_TAGS)),
+                param_hint='REPORT',
+            )
+        report, path = path[0], path[1:]
+    if report == constants.SERVE_MODE and not path:
+        raise click.BadParameter(
+            'serve expects the paths to serve', param_hint='PATH')
+    if validate_format and report != constants.VALIDATE_DOCSTRING_REPORT:
+        raise click.BadParameter(
+            'only the {0} report has machine readable formats'.format(
+                constants.VALIDATE_DOCSTRING_REPORT),
+            param_hint='--format',
+        )
+    path_type = click.Path(exists=True)
+    path = tuple(path_type.convert(value, None, None) for value in path)
     if config_file:
         SETTINGS['tokens'] = config.parse_config(config_file)
     if tokens:
@@ -29,4 +111,46 @@ def testimony(
     if minimum_tokens:
         config.update_tokens_dict(
             SETTINGS['tokens'], minimum_tokens, {'required': True})
-    main(report, path, json, markdown, nocolor)
+    if include:
+        SETTINGS['include'] = include
+    if exclude:
+        SETTINGS['exclude'] = constants.DEFAULT_EXCLUDE_PATTERNS + exclude
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if memo_size is None:
+        memo_size = constants.DEFAULT_PARSE_MEMO_SIZE
+    if use_cache and cache_dir is None:
+        cache_dir = constants.DEFAULT_CACHE_DIR
+    changed = None
+    if changed_since is not None or changed_files is not None:
+        changed = []
+        if changed_since is not None:
+            changed.extend(git_changed_files(changed_since))
+        if changed_files is not None:
+            changed.extend(
+                line.strip() for line in changed_files if line.strip())
+    main(report, path, json, markdown, nocolor, jobs, cache_dir, changed,
+         watch, profile, profile_output, jsonl, validate_format, socket_path,
+         memo_size)
+
+
+def git_changed_files(ref):
+    """Return the files changed since ``ref``, relative to the current dir.
+
+    Deleted files are not included.
+    """
+    try:
+        output = subprocess.run(
+            ['git', 'diff', '--name-only', '--relative', '--diff-filter=d',
+             ref, '--'],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as err:
+        raise click.BadParameter(
+            getattr(err, 'stderr', None) or str(err),
+            param_hint='--changed-since',
+        )
+    return output.splitlines()
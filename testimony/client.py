@@ -0,0 +1,65 @@
+# coding=utf-8
+"""Forward a testimony command line to a ``testimony serve`` process.
+
+Usage::
+
+    testimony-client [--socket PATH] REPORT [OPTIONS] [PATH]...
+
+The report, its options and paths are the ones of ``testimony``, see
+``testimony.server`` for the options a server doesn't accept. When no server
+listens on the socket, the command line runs in this process instead.
+"""
+import json
+import os
+import socket
+import sys
+
+from testimony.constants import DEFAULT_SOCKET_PATH
+
+RECEIVE_SIZE = 64 * 1024
+
+
+def request(socket_path, argv):
+    """Send ``argv`` to the server on ``socket_path`` and return its response.
+
+    :raises OSError: When no server listens on ``socket_path``.
+    """
+    message = json.dumps({
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'tty': sys.stdout.isatty(),
+    }).encode('utf-8')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(message)
+        connection.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = connection.recv(RECEIVE_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def main(argv=None):
+    """Forward ``argv``, the command line by default, and return the status."""
+    if argv is None:
+        argv = sys.argv[1:]
+    socket_path = DEFAULT_SOCKET_PATH
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        socket_path, argv = argv[1], argv[2:]
+    elif argv and argv[0].startswith('--socket='):
+        socket_path, argv = argv[0].split('=', 1)[1], argv[1:]
+    try:
+        response = request(socket_path, argv)
+    except OSError:
+        from testimony.cli import testimony
+        return testimony.main(argv, prog_name='testimony')
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
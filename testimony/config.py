@@ -13,20 +13,25 @@ Example:
             - Automated
     ...
 
-Currently only supported types are 'choice' and 'string'
-but in the future more can be added.
+Supported types are 'choice', 'int', 'list', 'regex', 'string' and 'url',
+see ``TokenConfig``. Every token is compiled into a validator when the
+config is loaded, so validating a token value doesn't depend on the size of
+its config.
 """
-
-import yaml
+import re
 
 from testimony.constants import TOKEN_TYPES
 
+_INT_RE = re.compile(r'[-+]?[0-9]+$')
+
 
 def parse_config(filehandle):
     """Parse the config.
 
     :param filehandle: File handle to read config from
     """
+    # Only imported when a configuration is given, it is slow to import
+    import yaml
     data = yaml.load(filehandle, Loader=yaml.SafeLoader)
     return {k.lower(): TokenConfig(k, v) for k, v in data.items()}
 
@@ -48,11 +53,105 @@ def update_tokens_dict(tokens_dict, new_keys, default_value=None):
             tokens_dict[key] = TokenConfig(key, default_value)
 
 
+def _any_value(what):
+    """Accept any value, the validator of tokens without a type."""
+    return True
+
+
+def _string_validator(token):
+    """Return the validator of a 'string' token."""
+    return lambda what: isinstance(what, str)
+
+
+def _choice_validator(token):
+    """Return the validator of a 'choice' token.
+
+    Like the validators of the other types, values which are not strings,
+    like the ``None`` value of a field starting with inline markup, are
+    invalid.
+    """
+    choices = frozenset(token.choices)
+    if token.casesensitive:
+        return lambda what: isinstance(what, str) and what in choices
+    return lambda what: isinstance(what, str) and what.lower() in choices
+
+
+def _list_validator(token):
+    """Return the validator of a 'list' token.
+
+    The value is split on ``token.separator`` and every non empty item must
+    be one of ``token.choices``.
+    """
+    choices = frozenset(token.choices)
+    separator = token.separator
+    casesensitive = token.casesensitive
+
+    def validate(what):
+        """Ensure that every item of ``what`` is a valid choice."""
+        if not isinstance(what, str):
+            return False
+        if not casesensitive:
+            what = what.lower()
+        items = {item.strip() for item in what.split(separator)}
+        items.discard('')
+        return bool(items) and items <= choices
+    return validate
+
+
+def _regex_validator(token):
+    """Return the validator of a 'regex' token, matching the whole value."""
+    flags = 0 if token.casesensitive else re.IGNORECASE
+    fullmatch = re.compile(token.pattern, flags).fullmatch
+    return lambda what: isinstance(what, str) and (
+        fullmatch(what) is not None)
+
+
+def _int_validator(token):
+    """Return the validator of an 'int' token."""
+    match = _INT_RE.match
+    return lambda what: isinstance(what, str) and (
+        match(what.strip()) is not None)
+
+
+def _url_validator(token):
+    """Return the validator of a 'url' token.
+
+    The value must be an absolute URL whose scheme is one of
+    ``token.schemes``.
+    """
+    # Imported here as the config module is imported at startup
+    from urllib.parse import urlsplit
+    schemes = frozenset(scheme.lower() for scheme in token.schemes)
+
+    def validate(what):
+        """Ensure that ``what`` is an absolute URL with a valid scheme."""
+        if not isinstance(what, str) or not what or any(
+                char.isspace() for char in what):
+            return False
+        try:
+            url = urlsplit(what)
+        except ValueError:
+            return False
+        return url.scheme in schemes and bool(url.netloc)
+    return validate
+
+
+_VALIDATOR_FACTORIES = {
+    'choice': _choice_validator,
+    'int': _int_validator,
+    'list': _list_validator,
+    'regex': _regex_validator,
+    'string': _string_validator,
+    'url': _url_validator,
+}
+
+
 class TokenConfig(object):
     """
     Represent config for one token.
 
-    Currently only checks for value.
+    Currently only checks for value. The value check is compiled into
+    ``validator`` when the token is created or updated.
     """
 
     def __init__(self, name, config):
@@ -69,31 +168,54 @@ class TokenConfig(object):
         self.name = name.lower()
         self.required = config.get('required', False)
         self.token_type = None
+        self.casesensitive = config.get('casesensitive', True)
 
         if config.get('type') in TOKEN_TYPES:
             self.token_type = config['type']
 
-        if self.token_type == 'choice':
+        if self.token_type in ('choice', 'list'):
             assert 'choices' in config
             assert isinstance(config['choices'], list)
-            self.casesensitive = config.get('casesensitive', True)
             self.choices = [i if self.casesensitive else i.lower()
                             for i in config['choices']]
+            self.separator = config.get('separator', ',')
+
+        elif self.token_type == 'regex':
+            assert 'pattern' in config
+            self.pattern = config['pattern']
+
+        elif self.token_type == 'url':
+            self.schemes = config.get('schemes', ['http', 'https'])
+            assert isinstance(self.schemes, list)
+
+        self.compile()
+
+    def __getstate__(self):
+        """Return the instance state without the compiled validator.
+
+        Validators are closures, which can't be pickled, and token configs
+        are sent to the worker processes of a parallel run.
+        """
+        state = self.__dict__.copy()
+        del state['validator']
+        return state
+
+    def __setstate__(self, state):
+        """Restore the instance state and compile the validator again."""
+        self.__dict__.update(state)
+        self.compile()
 
-        elif self.token_type == 'string':
-            pass
+    def compile(self):
+        """Compile the token type and its config into ``validator``."""
+        factory = _VALIDATOR_FACTORIES.get(self.token_type)
+        self.validator = _any_value if factory is None else factory(self)
 
     def update(self, new_values):
         """Update token configuration with dictionary of new values."""
         for key, value in new_values.items():
             setattr(self, key, value)
+        self.compile()
 
     def validate(self, what):
         """Ensure that 'what' meets value validation criteria."""
-        if self.token_type == 'choice':
-            if not self.casesensitive:
-                what = what.lower()
-            return what in self.choices
-        elif self.token_type == 'string':
-            return isinstance(what, str)  # validate it's a string
-        return True  # assume valid for unknown types
+        return self.validator(what)
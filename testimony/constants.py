@@ -16,9 +16,53 @@ REPORT_TAGS = (
     VALIDATE_DOCSTRING_REPORT,
 )
 
+WATCH_MODE = 'watch'
+SERVE_MODE = 'serve'
+
+PROJECT_URL = 'https://github.com/SatelliteQE/testimony/'
+
+# Machine readable formats of the validate report
+JUNIT_FORMAT = 'junit'
+SARIF_FORMAT = 'sarif'
+VALIDATE_FORMATS = (JUNIT_FORMAT, SARIF_FORMAT)
+
+DEFAULT_TEST_MODULE_PATTERNS = (
+    'test_*.py',
+    '*_test.py',
+)
+
+# Directories and files never walked looking for test modules
+DEFAULT_EXCLUDE_PATTERNS = (
+    '.git',
+    '.hg',
+    '.svn',
+    '.tox',
+    '.nox',
+    '.venv',
+    'venv',
+    'node_modules',
+    '__pycache__',
+)
+
+DEFAULT_CACHE_DIR = '.testimony_cache'
+
+# Unix socket of ``testimony serve``, relative to the current directory
+DEFAULT_SOCKET_PATH = '.testimony.sock'
+
+# Number of distinct docstrings whose parsing result is kept in memory
+DEFAULT_PARSE_MEMO_SIZE = 4096
+
+# Size of the text written at once by the text reports, unless the output is
+# a terminal, see ``testimony.output.TextWriter``
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
 TOKEN_TYPES = [
     'choice',
-    'string'
+    'int',
+    'list',
+    'regex',
+    'string',
+    'url',
 ]
 
 DEFAULT_TOKENS = (
@@ -46,3 +90,17 @@ PRINT_NO_DOC = 'Test cases with no docstrings'
 PRINT_NO_MINIMUM_DOC_TC = 'Test cases missing minimal docstrings'
 PRINT_TOTAL_TC = 'Total number of tests'
 PRINT_RST_PARSING_ISSUE = 'Test cases with unparseable docstrings'
+
+# Categories of the validate report issues, with their description
+ISSUE_MISSING_DOCSTRING = 'missing-docstring'
+ISSUE_MINIMUM_TOKENS = 'minimum-tokens'
+ISSUE_RST_PARSING = 'rst-parsing'
+ISSUE_UNEXPECTED_TOKENS = 'unexpected-tokens'
+ISSUE_INVALID_TOKEN_VALUES = 'invalid-token-values'
+ISSUE_CATEGORIES = (
+    (ISSUE_MISSING_DOCSTRING, PRINT_NO_DOC),
+    (ISSUE_MINIMUM_TOKENS, PRINT_NO_MINIMUM_DOC_TC),
+    (ISSUE_RST_PARSING, PRINT_RST_PARSING_ISSUE),
+    (ISSUE_UNEXPECTED_TOKENS, PRINT_UNEXPECTED_DOC_TC),
+    (ISSUE_INVALID_TOKEN_VALUES, PRINT_INVALID_VALUE),
+)
@@ -0,0 +1,289 @@
+# coding=utf-8
+"""Streaming writers of the reports output."""
+import json
+import os
+import sys
+
+from testimony.constants import OUTPUT_BUFFER_SIZE, PROJECT_URL
+
+
+def _uncolored(text, color=None, attrs=None):
+    """Return ``text`` as a string, ignoring ``color`` and ``attrs``."""
+    return str(text)
+
+
+class _StreamWriter(object):
+    """Base class of the writers of a document to a stream.
+
+    Use a writer as a context manager, or call ``close`` once everything is
+    written.
+    """
+
+    def __init__(self, stream=None):
+        """Initialize the writer, ``stream`` defaults to ``sys.stdout``."""
+        self.stream = sys.stdout if stream is None else stream
+
+    def __enter__(self):
+        """Return the writer."""
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        """Close the document unless an exception was raised."""
+        if exc_type is None:
+            self.close()
+        return False
+
+    def close(self):
+        """Write the end of the document."""
+        raise NotImplementedError
+
+
+class TextWriter(_StreamWriter):
+    """Write the text of a report one block at a time.
+
+    A report renders each block, usually the output of a test module, with
+    ``write`` then calls ``end_block``. Blocks are joined and written to the
+    stream once ``buffer_size`` characters are pending, and the stream is
+    flushed after every block when it is a terminal so the output still
+    shows up as the report goes. ``close`` writes what is pending and
+    flushes the stream.
+
+    ``colored`` is the function coloring the text, resolved once for the
+    report, see ``termcolor.colored``. The text is not colored by default.
+    """
+
+    def __init__(self, stream=None, colored=None,
+                 buffer_size=OUTPUT_BUFFER_SIZE):
+        """Initialize the writer, ``stream`` defaults to ``sys.stdout``."""
+        super(TextWriter, self).__init__(stream)
+        self.colored = _uncolored if colored is None else colored
+        self.buffer_size = buffer_size
+        isatty = getattr(self.stream, 'isatty', None)
+        self.interactive = bool(isatty and isatty())
+        self._parts = []
+        self._pending = 0
+
+    def __exit__(self, *exc_info):
+        """Write the pending text, whether an exception was raised or not."""
+        self.close()
+        return False
+
+    def write(self, text):
+        """Append ``text`` to the current block."""
+        self._parts.append(text)
+        self._pending += len(text)
+
+    def end_block(self):
+        """End the current block, writing the pending text if needed."""
+        if self.interactive:
+            self.close()
+        elif self._pending >= self.buffer_size:
+            self._write_pending()
+
+    def close(self):
+        """Write the pending text and flush the stream."""
+        self._write_pending()
+        self.stream.flush()
+
+    def _write_pending(self):
+        """Write the pending text to the stream as a single string."""
+        if self._parts:
+            self.stream.write(''.join(self._parts))
+            self._parts = []
+            self._pending = 0
+
+
+class JSONArrayWriter(_StreamWriter):
+    """Write a JSON array to a stream one item at a time.
+
+    The output is the same as ``json.dumps`` of the list of the items
+    followed by a new line, but only one item is encoded at a time, so
+    neither the list nor the whole document is kept in memory.
+    """
+
+    def __init__(self, stream=None):
+        """Initialize the writer, ``stream`` defaults to ``sys.stdout``."""
+        super(JSONArrayWriter, self).__init__(stream)
+        self._separator = '['
+
+    def write(self, item):
+        """Encode and write ``item`` as the next array element."""
+        self.stream.write(self._separator)
+        self.stream.write(json.dumps(item))
+        self._separator = ', '
+
+    def close(self):
+        """Write the end of the array, an empty one if nothing was written."""
+        if self._separator == '[':
+            self.stream.write('[')
+        self.stream.write(']\n')
+
+
+class JSONLinesWriter(JSONArrayWriter):
+    """Write items as newline delimited JSON, one item per line.
+
+    Each line is a complete JSON document, so the output can be consumed
+    line by line as it is written.
+    """
+
+    def write(self, item):
+        """Encode and write ``item`` on its own line."""
+        self.stream.write(json.dumps(item))
+        self.stream.write('\n')
+
+    def close(self):
+        """Do nothing, every line is already complete."""
+
+
+def _module_name(path):
+    """Return the dotted name of the ``path`` module, as shown by JUnit."""
+    name = os.path.splitext(os.path.normpath(path))[0]
+    return name.replace(os.sep, '.').strip('.')
+
+
+def _artifact_uri(path):
+    """Return the SARIF artifact URI of ``path``."""
+    import pathlib
+    import urllib.parse
+    if os.path.isabs(path):
+        return pathlib.Path(path).as_uri()
+    return urllib.parse.quote(pathlib.PurePath(path).as_posix())
+
+
+class JUnitWriter(_StreamWriter):
+    """Write validation results as a JUnit XML document.
+
+    Each test module is a test suite written by ``write_module``, where an
+    invalid test case has a failure whose type is the categories of its
+    issues.
+    """
+
+    def __init__(self, stream=None):
+        """Initialize the writer and write the start of the document."""
+        super(JUnitWriter, self).__init__(stream)
+        self.stream.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<testsuites name="testimony">\n'
+        )
+
+    def write_module(self, path, results):
+        """Write the test suite of the ``path`` test module.
+
+        :param results: ``(testcase, issues)`` pairs of the module test cases,
+            ``issues`` being a list of ``(category, message)`` pairs, empty
+            when the test case is valid.
+        """
+        # Imported here as it imports urllib.request, which is slow to import
+        from xml.sax.saxutils import escape, quoteattr
+        module = _module_name(path)
+        parts = ['<testsuite name={0} tests="{1}" failures="{2}">\n'.format(
+            quoteattr(path),
+            len(results),
+            sum(1 for _, issues in results if issues),
+        )]
+        for testcase, issues in results:
+            classname = module
+            if testcase.parent_class:
+                classname += '.' + testcase.parent_class.replace('::', '.')
+            parts.append(
+                '<testcase classname={0} name={1} file={2} line="{3}"'.format(
+                    quoteattr(classname),
+                    quoteattr(testcase.name),
+                    quoteattr(path),
+                    testcase.lineno,
+                )
+            )
+            if not issues:
+                parts.append(' />\n')
+                continue
+            parts.append(
+                '>\n<failure type={0} message={1}>{2}</failure>\n'
+                '</testcase>\n'.format(
+                    quoteattr(','.join(category for category, _ in issues)),
+                    quoteattr('; '.join(
+                        message.splitlines()[0] for _, message in issues)),
+                    escape('\n'.join(
+                        '* {0}'.format(message) for _, message in issues)),
+                )
+            )
+        parts.append('</testsuite>\n')
+        self.stream.write(''.join(parts))
+
+    def close(self):
+        """Write the end of the document."""
+        self.stream.write('</testsuites>\n')
+
+
+class SARIFWriter(_StreamWriter):
+    """Write validation results as a SARIF 2.1.0 log.
+
+    Every issue of an invalid test case is a result, located on the test
+    function definition, whose rule is the issue category.
+    """
+
+    def __init__(self, stream=None, rules=()):
+        """Initialize the writer and write the start of the log.
+
+        :param rules: ``(category, description)`` pairs of the issue
+            categories.
+        """
+        super(SARIFWriter, self).__init__(stream)
+        self.rule_indexes = {
+            category: index for index, (category, _) in enumerate(rules)}
+        log = json.dumps({
+            '$schema': 'https://json.schemastore.org/sarif-2.1.0.json',
+            'version': '2.1.0',
+            'runs': [{
+                'tool': {'driver': {
+                    'name': 'testimony',
+                    'informationUri': PROJECT_URL,
+                    'rules': [
+                        {
+                            'id': category,
+                            'shortDescription': {'text': description},
+                        }
+                        for category, description in rules
+                    ],
+                }},
+                'results': [],
+            }],
+        })
+        # Stop right after the opening bracket of the results, which are the
+        # last member of the log
+        self.stream.write(log[:-len(']}]}')])
+        self._separator = ''
+
+    def write_module(self, path, results):
+        """Write the results of the ``path`` test module.
+
+        See ``JUnitWriter.write_module`` for ``results``.
+        """
+        uri = _artifact_uri(path)
+        for testcase, issues in results:
+            if testcase.parent_class:
+                name = '{0}::{1}'.format(testcase.parent_class, testcase.name)
+            else:
+                name = testcase.name
+            for category, message in issues:
+                self.stream.write(self._separator)
+                self.stream.write(json.dumps({
+                    'ruleId': category,
+                    'ruleIndex': self.rule_indexes[category],
+                    'level': 'error',
+                    'message': {'text': message},
+                    'locations': [{
+                        'physicalLocation': {
+                            'artifactLocation': {'uri': uri},
+                            'region': {'startLine': testcase.lineno},
+                        },
+                        'logicalLocations': [{
+                            'fullyQualifiedName': name,
+                            'kind': 'function',
+                        }],
+                    }],
+                }))
+                self._separator = ', '
+
+    def close(self):
+        """Write the end of the log."""
+        self.stream.write(']}]}\n')
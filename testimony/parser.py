@@ -1,39 +1,307 @@
 # coding=utf-8
 """Docstring parser utilities for Testimony."""
-from collections import namedtuple
+import functools
+import re
+from collections import OrderedDict, namedtuple
 from io import StringIO
-from xml.etree import ElementTree
 
-from docutils.core import publish_string
-from docutils.parsers.rst import nodes, roles
-from docutils.readers import standalone
-from docutils.transforms import frontmatter
-
-from testimony.constants import DEFAULT_MINIMUM_TOKENS, DEFAULT_TOKENS
+from testimony.constants import (
+    DEFAULT_MINIMUM_TOKENS,
+    DEFAULT_PARSE_MEMO_SIZE,
+    DEFAULT_TOKENS,
+)
+from testimony.profiling import NULL_PROFILER
 
 RSTParseMessage = namedtuple('RSTParseMessage', 'line level message')
 
+# Patterns used by the fast path parser, see ``scan_fields``
+_FIELD_RE = re.compile(r':([^\W_][\w-]*):(?: +(.*))?$')
+_ENUMERATOR_RE = re.compile(r'([0-9]+)\. +(\S.*)$')
+# Inline markup, escapes, standalone URIs and emails, literal blocks and
+# hyperlink references or targets
+_UNSAFE_TEXT_RE = re.compile(
+    r'[*`|\\@\t]|::|:\S|(?<![^\W_])_|_(?![^\W_])')
+# Bullets, option lists, explicit markup, doctests, anonymous targets and
+# enumerators
+_UNSAFE_START_RE = re.compile(
+    r'[-+*/#|>\u2022\u2023\u2043]|\.\.|__(?:\s|$)|'
+    r'\(?[^\W_]+[.)](?:\s|$)')
+# Tabs and literal blocks, which change the document structure even when
+# inline markup is allowed, see ``scan_fields``
+_UNSAFE_STRUCTURE_RE = re.compile(r'\t|::')
+# Inline markup which may start a paragraph, standalone URIs and emails
+_INLINE_START_RE = re.compile(r'[*`|\[\]_:@\\<]')
+# Section adornments, transitions and simple tables
+_PUNCTUATION_LINE_RE = re.compile(r'[\W_]+$')
+# Replaced by spaces by docutils before splitting lines, while
+# ``str.splitlines`` splits on them
+_VERTICAL_SPACE_RE = re.compile('[\v\f]')
+
+
+# Value of the fields with an empty body, ``None`` being the value of a
+# paragraph starting with inline markup
+EMPTY_BODY = object()
+
+
+class FastPathUnsupported(Exception):
+    """Raised when a docstring needs the full docutils parser."""
+
+
+def _check_text(line, block_start=True, inline=False):
+    """Ensure that ``line`` is plain text for docutils.
+
+    :param block_start: Indicate if ``line`` may start a new body element.
+    :param inline: Allow inline markup, which doesn't change the document
+        structure.
+    :raises FastPathUnsupported: If ``line`` may contain RST markup.
+    """
+    if inline:
+        unsafe = _UNSAFE_STRUCTURE_RE.search(line) or (
+            block_start and line.startswith(':'))
+    else:
+        unsafe = _UNSAFE_TEXT_RE.search(line)
+    if (
+            unsafe or
+            _PUNCTUATION_LINE_RE.match(line) or
+            block_start and _UNSAFE_START_RE.match(line)
+    ):
+        raise FastPathUnsupported(line)
+
+
+def _scan_enumerated_list(lines, inline=False):
+    """Return the value of a field body made of an enumerated list.
+
+    See ``_scan_field_body`` for ``inline``.
+    """
+    items = []
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if not line:
+            index += 1
+            continue
+        match = _ENUMERATOR_RE.match(line)
+        if not match or int(match.group(1)) != len(items) + 1:
+            raise FastPathUnsupported(line)
+        _check_text(match.group(2), inline=inline)
+        text = [match.group(2)]
+        index += 1
+        # Item continuation lines must be aligned with the item text
+        indent = match.start(2)
+        while index < len(lines) and lines[index].startswith(' '):
+            line = lines[index]
+            if len(line) - len(line.lstrip()) != indent:
+                raise FastPathUnsupported(line)
+            line = line[indent:]
+            _check_text(line, inline=inline)
+            text.append(line)
+            index += 1
+        if index < len(lines) and lines[index]:
+            # An unindented line which is not the next item ends the list
+            # without a blank line
+            if not _ENUMERATOR_RE.match(lines[index]):
+                raise FastPathUnsupported(lines[index])
+        items.append('\n'.join(text))
+    return '\n'.join(
+        u'{}. {}'.format(number, text)
+        for number, text in enumerate(items, start=1)
+    )
+
+
+def _scan_field_body(lines, inline=False):
+    """Return the value of a field body or ``EMPTY_BODY`` if it is empty.
+
+    ``lines`` are the field body lines with the common indentation removed,
+    the body must be a single paragraph or an enumerated list. When
+    ``inline`` is ``True`` the body may contain inline markup, except at the
+    start of a paragraph where it would leave the token without value, and
+    the returned value is the raw body text.
+    """
+    while lines and not lines[0]:
+        lines = lines[1:]
+    if not lines:
+        return EMPTY_BODY
+    if _ENUMERATOR_RE.match(lines[0]):
+        return _scan_enumerated_list(lines, inline)
+    for index, line in enumerate(lines):
+        if not line or line.startswith(' '):
+            raise FastPathUnsupported(line)
+        _check_text(line, block_start=index == 0, inline=inline)
+    if inline and _INLINE_START_RE.search(lines[0].split(None, 1)[0]):
+        raise FastPathUnsupported(lines[0])
+    return '\n'.join(lines)
+
+
+def scan_fields(docstring, names_only=False):
+    """Extract the top level fields of ``docstring`` without docutils.
+
+    Only a subset of RST is handled: unindented paragraphs of plain text and
+    field lists whose bodies are a paragraph or an enumerated list numbered
+    from 1. Within that subset docutils reports no parsing issue, so the
+    result is the same as the one of the docutils based parser.
 
-class _NoDocInfoReader(standalone.Reader):
-    """Reader that does not do the DocInfo transformation.
+    When ``names_only`` is ``True`` paragraphs and bodies may also contain
+    inline markup. The field names, and whether the fields have a value, are
+    still the same as the docutils based parser ones but the values are the
+    raw body text.
 
-    Extend standalone reader and drop the DocInfo transformation. Without that
-    transformation, the first field list element will remain a field list and
-    won't be converted to a docinfo element.
+    :return: A list of ``(name, value)`` tuples, ``value`` being
+        ``EMPTY_BODY`` for fields with an empty body.
+    :raises FastPathUnsupported: If the docstring is outside of the subset.
     """
+    lines = [
+        line.rstrip()
+        for line in _VERTICAL_SPACE_RE.sub(' ', docstring).splitlines()
+    ]
+    fields = []
+    previous = None
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        index += 1
+        if not line:
+            previous = None
+            continue
+        if line.startswith(' '):
+            raise FastPathUnsupported(line)
+        match = _FIELD_RE.match(line)
+        if match is None:
+            # Paragraph line, a field list must end with a blank line
+            if previous == 'field':
+                raise FastPathUnsupported(line)
+            _check_text(
+                line, block_start=previous is None, inline=names_only)
+            previous = 'paragraph'
+            continue
+        if previous == 'paragraph':
+            raise FastPathUnsupported(line)
+        name = match.group(1)
+        _check_text(name, block_start=False)
+        block = []
+        while index < len(lines) and (
+                not lines[index] or lines[index].startswith(' ')):
+            block.append(lines[index])
+            index += 1
+        previous = 'field'
+        while block and not block[-1]:
+            block.pop()
+            previous = None
+        if block:
+            indent = min(len(line) - len(line.lstrip())
+                         for line in block if line)
+            block = [line[indent:] for line in block]
+        first_line = match.group(2) or ''
+        fields.append((
+            name.lower(),
+            _scan_field_body([first_line] + block, inline=names_only),
+        ))
+    return fields
+
+
+def _children(node, tagname, subtagname):
+    """Yield ``node`` grandchildren tagged ``subtagname``.
+
+    Only the grandchildren under children tagged ``tagname`` are considered.
+    """
+    for child in node.children:
+        if child.tagname == tagname:
+            for subchild in child.children:
+                if subchild.tagname == subtagname:
+                    yield subchild
+
+
+def _text(node):
+    """Return the text of ``node`` preceding its first child element.
+
+    Standalone URIs are kept as text, so URLs can be token values. Return
+    ``None`` when ``node`` starts with another child element, like inline
+    markup.
+    """
+    text = []
+    for child in node.children:
+        if child.tagname == 'reference' and (
+                child.get('refuri') == child.astext()):
+            text.append(child.astext())
+            continue
+        if child.tagname != '#text':
+            break
+        text.append(child.astext())
+    return ''.join(text) or None
+
+
+@functools.lru_cache(maxsize=None)
+def _no_docinfo_reader_class():
+    """Return the reader class which doesn't do the DocInfo transformation.
+
+    The class is defined on first use, docutils being only imported when a
+    docstring needs it.
+    """
+    from docutils.readers import standalone
+    from docutils.transforms import frontmatter
+
+    class NoDocInfoReader(standalone.Reader):
+        """Reader that does not do the DocInfo transformation.
+
+        Extend standalone reader and drop the DocInfo transformation. Without
+        that transformation, the first field list element will remain a field
+        list and won't be converted to a docinfo element.
+        """
+
+        def get_transforms(self):
+            """Get default transforms without DocInfo."""
+            transforms = standalone.Reader.get_transforms(self)
+            transforms.remove(frontmatter.DocInfo)
+            return transforms
+
+    return NoDocInfoReader
+
+
+_roles_registered = False
 
-    def get_transforms(self):
-        """Get default transforms without DocInfo."""
-        transforms = standalone.Reader.get_transforms(self)
-        transforms.remove(frontmatter.DocInfo)
-        return transforms
+
+def _register_roles():
+    """Register the Python domain roles as generic roles, only once."""
+    global _roles_registered
+    if _roles_registered:
+        return
+    from docutils.parsers.rst import nodes, roles
+    for role in (
+            'data', 'exc', 'func', 'class', 'const', 'attr', 'meth', 'mod',
+            'obj'
+    ):
+        roles.register_generic_role(role, nodes.raw)
+        roles.register_generic_role('py:' + role, nodes.raw)
+    _roles_registered = True
 
 
 class DocstringParser(object):
     """Parse docstring extracting tokens."""
 
-    def __init__(self, tokens=None, minimum_tokens=None):
-        """Initialize the parser with expected tokens and the minimum set."""
+    def __init__(self, tokens=None, minimum_tokens=None, fast=True,
+                 memo_size=DEFAULT_PARSE_MEMO_SIZE):
+        """Initialize the parser with expected tokens and the minimum set.
+
+        When ``fast`` is ``True`` docstrings are first handed to
+        ``scan_fields`` and docutils is only used for the ones it can't
+        handle.
+
+        The results of the last ``memo_size`` distinct docstrings are kept on
+        a LRU memo, so identical docstrings are parsed once. The memo belongs
+        to the parser, whose tokens never change, so it is keyed by the
+        docstring. ``memo_hits`` and ``memo_misses`` count the lookups, use a
+        ``memo_size`` of ``0`` to disable it.
+
+        The parsing time is recorded by ``profiler``, a
+        ``testimony.profiling.Profiler``, when it is set.
+        """
+        self.fast = fast
+        self.profiler = NULL_PROFILER
+        self.memo_size = memo_size
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._memo = OrderedDict()
+        self._publisher = None
+        self._warning_stream = None
         if tokens is None:
             self.tokens = DEFAULT_TOKENS
         else:
@@ -47,12 +315,53 @@ class DocstringParser(object):
         if not self.minimum_tokens.issubset(self.tokens):
             raise ValueError('tokens should contain minimum_tokens')
 
-        for role in (
-                'data', 'exc', 'func', 'class', 'const', 'attr', 'meth', 'mod',
-                'obj'
-        ):
-            roles.register_generic_role(role, nodes.raw)
-            roles.register_generic_role('py:' + role, nodes.raw)
+    def __getstate__(self):
+        """Return the instance state without the docutils publisher.
+
+        The memo and profiler are not kept either, parsers are pickled along
+        with every ``TestRecord``.
+        """
+        state = self.__dict__.copy()
+        state['_publisher'] = None
+        state['_warning_stream'] = None
+        state['_memo'] = OrderedDict()
+        state['profiler'] = NULL_PROFILER
+        return state
+
+    def _get_publisher(self):
+        """Return the docutils publisher, building it on first use.
+
+        The publisher and its settings, reader, parser and writer are built
+        once and reused for every docstring, each ``publish`` call creating a
+        new document. Docutils is imported and the Python domain roles are
+        registered at that point.
+        """
+        if self._publisher is None:
+            from docutils.core import Publisher
+            from docutils.io import NullOutput, StringInput
+            from docutils.parsers.rst import Parser
+            from docutils.writers import null
+
+            _register_roles()
+            self._warning_stream = StringIO()
+            parser = Parser()
+            self._publisher = Publisher(
+                reader=_no_docinfo_reader_class()(parser=parser),
+                parser=parser,
+                writer=null.Writer(),
+                source_class=StringInput,
+                destination=NullOutput(),
+            )
+            self._publisher.process_programmatic_settings(
+                None,
+                {
+                    'input_encoding': 'utf-8',
+                    'syntax_highlight': 'short',
+                    'warning_stream': self._warning_stream,
+                },
+                None,
+            )
+        return self._publisher
 
     def parse(self, docstring=None):
         """Parse docstring and report parsing issues, valid and invalid tokens.
@@ -76,28 +385,55 @@ class DocstringParser(object):
                 {'invalid_tag1': 'value1', 'invalid_tag2': 'value2'},
                 [],  # List of RSTParseMessage with any formatting issue found
             )
+
+        The returned dicts and list are copies, callers may update them.
         """
         if docstring is None:
             return {}, {}, []
-        tokens_dict = {}
-        valid_tokens = {}
-        invalid_tokens = {}
+        valid_tokens, invalid_tokens, rst_parse_messages = self._memoized(
+            self._parse, docstring)
+        return dict(valid_tokens), dict(invalid_tokens), list(
+            rst_parse_messages)
+
+    def _memoized(self, parse, docstring):
+        """Return ``parse(docstring)``, looking it up on the memo first."""
+        if not self.memo_size:
+            return parse(docstring)
+        key = (parse.__name__, docstring)
+        try:
+            result = self._memo[key]
+        except KeyError:
+            self.memo_misses += 1
+            result = self._memo[key] = parse(docstring)
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        else:
+            self.memo_hits += 1
+            self._memo.move_to_end(key)
+        return result
 
-        # Parse the docstring with the docutils RST parser and output the
-        # result as XML, this ease the process of getting the tokens
-        # information.
-        warning_stream = StringIO()
-        docstring_xml = publish_string(
-            docstring,
-            reader=_NoDocInfoReader(),
-            settings_overrides={
-                'embed_stylesheet': False,
-                'input_encoding': 'utf-8',
-                'syntax_highlight': 'short',
-                'warning_stream': warning_stream,
-            },
-            writer_name='xml',
-        )
+    def _parse(self, docstring):
+        """Parse a docstring, see ``parse``."""
+        if self.fast:
+            with self.profiler.stage('docstring fast path'):
+                try:
+                    return self._split_fields(scan_fields(docstring)) + ([],)
+                except FastPathUnsupported:
+                    pass
+        with self.profiler.stage('docstring docutils'):
+            return self._parse_docutils(docstring)
+
+    def _parse_docutils(self, docstring):
+        """Parse a docstring with docutils, see ``parse``."""
+        # Parse the docstring with the docutils RST parser and walk the
+        # resulting document tree to get the tokens information.
+        publisher = self._get_publisher()
+        warning_stream = self._warning_stream
+        warning_stream.seek(0)
+        warning_stream.truncate()
+        publisher.set_source(docstring)
+        publisher.publish()
+        document = publisher.document
 
         rst_parse_messages = []
         for warning in warning_stream.getvalue().splitlines():
@@ -109,25 +445,77 @@ class DocstringParser(object):
                 level=warning[1].split('/')[0][1:].lower(),
                 message=warning[2],
             ))
-        warning_stream.close()
 
-        root = ElementTree.fromstring(docstring_xml)
-        tokens = root.findall('./field_list/field')
-        for token in tokens:
-            token_name = token.find('./field_name').text.lower()
-            value_el = token.find('./field_body/')
+        fields = []
+        report_level = document.settings.report_level
+        for field in _children(document, 'field_list', 'field'):
+            token_name = _text(field[0]).lower()
+            value_el = next((
+                child for child in field[1].children
+                if child.tagname != 'system_message' or
+                child['level'] >= report_level
+            ), None)
             if value_el is None:
-                invalid_tokens[token_name] = ''
+                fields.append((token_name, EMPTY_BODY))
                 continue
-            if value_el.tag == 'paragraph':
-                value = value_el.text
-            if value_el.tag == 'enumerated_list':
-                value_lst = map(lambda elem: elem.text,
-                                value_el.findall('./list_item/paragraph'))
+            if value_el.tagname == 'paragraph':
+                value = _text(value_el)
+            if value_el.tagname == 'enumerated_list':
+                value_lst = map(
+                    _text, _children(value_el, 'list_item', 'paragraph'))
                 list_enum = list(enumerate(value_lst, start=1))
                 steps = map(lambda val: u'{}. {}'.format(val[0], val[1]),
                             list_enum)
                 value = '\n'.join(steps)
+            fields.append((token_name, value))
+
+        valid_tokens, invalid_tokens = self._split_fields(fields)
+        return valid_tokens, invalid_tokens, rst_parse_messages
+
+    def parse_names(self, docstring=None):
+        """Return the valid and invalid token names of ``docstring``.
+
+        The names are the keys of the dicts returned by ``parse``, in the
+        same order, but they are extracted without docutils for more
+        docstrings since the token values and RST parsing issues are not
+        needed, see ``scan_fields``.
+
+        :return: A ``(valid names, invalid names)`` tuple of lists.
+        """
+        if docstring is None:
+            return [], []
+        valid_tokens, invalid_tokens = self._memoized(
+            self._parse_names, docstring)
+        return list(valid_tokens), list(invalid_tokens)
+
+    def _parse_names(self, docstring):
+        """Return the token names of a docstring, see ``parse_names``."""
+        if self.fast:
+            with self.profiler.stage('docstring names'):
+                try:
+                    valid_tokens, invalid_tokens = self._split_fields(
+                        scan_fields(docstring, names_only=True))
+                except FastPathUnsupported:
+                    pass
+                else:
+                    return list(valid_tokens), list(invalid_tokens)
+        valid_tokens, invalid_tokens, _ = self.parse(docstring)
+        return list(valid_tokens), list(invalid_tokens)
+
+    def _split_fields(self, fields):
+        """Split ``(name, value)`` fields into valid and invalid tokens.
+
+        Fields with an empty body, which have ``EMPTY_BODY`` as value, are
+        always invalid. Fields whose value is ``None``, a paragraph starting
+        with inline markup, are tokens like the other ones.
+        """
+        tokens_dict = {}
+        valid_tokens = {}
+        invalid_tokens = {}
+        for token_name, value in fields:
+            if value is EMPTY_BODY:
+                invalid_tokens[token_name] = ''
+                continue
             tokens_dict[token_name] = value
 
         for token, value in tokens_dict.items():
@@ -136,7 +524,7 @@ class DocstringParser(object):
             else:
                 invalid_tokens[token] = value
 
-        return valid_tokens, invalid_tokens, rst_parse_messages
+        return valid_tokens, invalid_tokens
 
     def validate_tokens(self, tokens):
         """Check if the ``tokens`` is a superset of ``minimum_tokens``."""
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Wall and CPU time spent on each stage of a run."""
+import collections
+import json
+import time
+
+
+class _Stage(object):
+    """Context manager timing one call of a ``Profiler`` stage."""
+
+    __slots__ = ('profiler', 'name', 'wall', 'cpu')
+
+    def __init__(self, profiler, name):
+        """Initialize the ``name`` stage of ``profiler``."""
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        """Start timing, pausing the enclosing stage."""
+        self.profiler._stack.append([0.0, 0.0])
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop timing and record the stage own time."""
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stack = self.profiler._stack
+        nested_wall, nested_cpu = stack.pop()
+        if stack:
+            stack[-1][0] += wall
+            stack[-1][1] += cpu
+        stats = self.profiler.stages.setdefault(self.name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += wall - nested_wall
+        stats[2] += cpu - nested_cpu
+        return False
+
+
+class _NullStage(object):
+    """Context manager doing nothing, see ``NullProfiler``."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        """Do nothing."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Do nothing."""
+        return False
+
+
+class NullProfiler(object):
+    """Profiler which doesn't record anything, used when not profiling."""
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        """Return a context manager doing nothing."""
+        return self._stage
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(object):
+    """Record the calls, wall and CPU time of the stages of a run.
+
+    Use ``stage`` as a context manager around each stage. Stages can be
+    nested, the time of a stage excludes the time of the stages it encloses
+    so the stage times add up to the profiled time.
+    """
+
+    def __init__(self):
+        """Initialize a profiler without any recorded stage."""
+        self.stages = collections.OrderedDict()
+        self._stack = []
+
+    def stage(self, name):
+        """Return a context manager timing the ``name`` stage."""
+        return _Stage(self, name)
+
+    def to_dict(self, counters=None):
+        """Return the recorded stages and ``counters`` as a dict."""
+        return {
+            'stages': collections.OrderedDict(
+                (name, {'calls': calls, 'wall': wall, 'cpu': cpu})
+                for name, (calls, wall, cpu) in self.stages.items()
+            ),
+            'total': {
+                'wall': sum(stats[1] for stats in self.stages.values()),
+                'cpu': sum(stats[2] for stats in self.stages.values()),
+            },
+            'counters': collections.OrderedDict(counters or ()),
+        }
+
+    def report(self, stream, json_output=False, counters=None):
+        """Print the recorded stages to ``stream``.
+
+        :param json_output: Print a JSON object instead of a table.
+        :param counters: Optional ``(name, value)`` pairs printed after the
+            stages, like cache hits and misses.
+        """
+        data = self.to_dict(counters)
+        if json_output:
+            print(json.dumps(data), file=stream)
+            return
+        total_wall = data['total']['wall']
+        rows = [
+            (name, str(stats['calls']), stats['wall'], stats['cpu'])
+            for name, stats in data['stages'].items()
+        ]
+        rows.append(('total', '', total_wall, data['total']['cpu']))
+        width = max(len(row[0]) for row in rows + [('Stage',)])
+        print('{0:<{width}}  {1:>8}  {2:>9}  {3:>9}  {4:>6}'.format(
+            'Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Wall %', width=width),
+            file=stream)
+        for name, calls, wall, cpu in rows:
+            print('{0:<{width}}  {1:>8}  {2:>9.3f}  {3:>9.3f}  {4:>6.1f}'
+                  .format(name, calls, wall, cpu,
+                          wall / total_wall * 100 if total_wall else 0.0,
+                          width=width),
+                  file=stream)
+        for name, value in data['counters'].items():
+            print('{0}: {1}'.format(name, value), file=stream)
@@ -0,0 +1,309 @@
+# coding=utf-8
+"""Answer report requests from a resident process keeping test cases parsed.
+
+``serve`` parses the test modules of the served paths once, then listens on
+a Unix socket for the command lines forwarded by ``testimony.client``. Each
+request runs the report on the test cases kept in memory, after parsing
+again the test modules which changed, see ``WatchIndex``, so it pays neither
+for the interpreter startup nor for a cold parse of the tree.
+
+A request is a JSON object with the ``argv`` command line arguments, the
+client current directory ``cwd`` and whether its stdout is a terminal
+``tty``. The response is a JSON object with the report ``stdout``,
+``stderr`` and exit ``status``. Both are sent as UTF-8 and each side shuts
+its connection down once its message is sent.
+"""
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import traceback
+
+import click
+
+from testimony import (
+    SETTINGS,
+    RunContext,
+    configure_output,
+    get_report_function,
+    iter_testcases,
+)
+from testimony.constants import REPORT_TAGS
+from testimony.watch import WatchIndex
+
+# Options loaded once when the server starts, requests can't change them
+SERVER_OPTIONS = (
+    ('tokens', '--tokens'),
+    ('minimum_tokens', '--minimum-tokens'),
+    ('config_file', '--config'),
+    ('include', '--include'),
+    ('exclude', '--exclude'),
+    ('memo_size', '--memo-size'),
+)
+
+# Options requests don't support, the server parses the test modules in its
+# own process and keeps them in memory instead of on a cache
+UNSUPPORTED_OPTIONS = (
+    ('jobs', '--jobs'),
+    ('use_cache', '--cache'),
+    ('cache_dir', '--cache-dir'),
+    ('changed_since', '--changed-since'),
+    ('changed_files', '--changed-files'),
+    ('profile', '--profile'),
+    ('profile_output', '--profile-output'),
+)
+
+# Output settings set by each request
+OUTPUT_SETTINGS = ('json', 'jsonl', 'format', 'markdown', 'nocolor')
+
+RECEIVE_SIZE = 64 * 1024
+
+
+class _Capture(io.StringIO):
+    """Text stream capturing the output sent back to the client."""
+
+    def __init__(self, tty=False):
+        """Initialize the stream, ``tty`` is what ``isatty`` returns."""
+        super(_Capture, self).__init__()
+        self.tty = tty
+
+    def isatty(self):
+        """Return whether the client output is a terminal."""
+        return self.tty
+
+
+def _given(value):
+    """Return whether an option ``value`` was given, ``0`` included."""
+    return value is not None and value is not False and value != ()
+
+
+def parse_arguments(argv):
+    """Return the ``testimony`` command parameters of the ``argv`` request.
+
+    Paths are checked relative to the current directory.
+
+    :raises click.ClickException: When ``argv`` is invalid or uses options
+        the server doesn't support.
+    :raises click.exceptions.Exit: When ``argv`` asks for the help.
+    """
+    from testimony.cli import testimony
+    params = testimony.make_context('testimony', list(argv)).params
+    for name, option in SERVER_OPTIONS:
+        if _given(params[name]):
+            raise click.UsageError(
+                '{0} must be given to testimony serve'.format(option))
+    for name, option in UNSUPPORTED_OPTIONS:
+        if _given(params[name]):
+            raise click.UsageError(
+                '{0} is not supported by testimony serve'.format(option))
+    if params['report'] not in REPORT_TAGS:
+        raise click.BadParameter(
+            'expected one of {0}'.format(', '.join(REPORT_TAGS)),
+            param_hint='REPORT',
+        )
+    path_type = click.Path(exists=True)
+    params['path'] = tuple(
+        path_type.convert(value, None, None) for value in params['path'])
+    return params
+
+
+class Server(object):
+    """Run the report requests on the test cases of the served ``paths``.
+
+    The test cases are kept on a ``WatchIndex``, refreshed before running
+    each request. Requested paths outside of the served paths are parsed
+    with a ``RunContext`` of the request, built from the index tokens, as
+    nothing tells when those files change.
+    """
+
+    def __init__(self, paths, context=None):
+        """Initialize the server and parse every test module of ``paths``."""
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.index = WatchIndex(self.paths, context)
+
+    def _served(self, path):
+        """Return whether the absolute ``path`` is under a served path."""
+        return any(
+            path == served or path.startswith(served + os.sep)
+            for served in self.paths
+        )
+
+    def iter_testcases(self, paths):
+        """Yield the ``(path, tests)`` pairs of each test module of ``paths``.
+
+        Test modules are named and ordered as if ``paths`` were walked, see
+        ``testimony.iter_testcases``.
+        """
+        seen = set()
+        context = None
+        for path in paths:
+            root = os.path.abspath(path)
+            if not self._served(root):
+                if context is None:
+                    context = RunContext(self.index.context.tokens)
+                items = iter_testcases([path], context=context)
+            elif os.path.isfile(root):
+                items = [
+                    (path, self.index.testcases[root])
+                ] if root in self.index.testcases else []
+            else:
+                items = (
+                    (os.path.join(path, os.path.relpath(testmodule, root)),
+                     tests)
+                    for testmodule, tests in self.index.testcases.items()
+                    if testmodule.startswith(root + os.sep)
+                )
+            for testmodule, tests in items:
+                if testmodule not in seen:
+                    seen.add(testmodule)
+                    yield testmodule, tests
+
+    def run(self, argv):
+        """Run the ``argv`` report request and return its exit status."""
+        try:
+            params = parse_arguments(argv)
+        except click.exceptions.Exit as err:
+            return err.exit_code
+        except click.ClickException as err:
+            err.show()
+            return err.exit_code
+        configure_output(params['json'], params['markdown'],
+                         params['nocolor'], params['jsonl'],
+                         params['validate_format'])
+        self.index.refresh()
+        report_function = get_report_function(params['report'])
+        try:
+            return report_function(self.iter_testcases(params['path'])) or 0
+        except Exception:
+            # Report the error to the client and keep serving
+            traceback.print_exc()
+            return 1
+
+    def handle(self, request):
+        """Run ``request`` and return the response, see ``testimony.server``.
+
+        The request runs from the client current directory, with its output
+        captured, and the output ``SETTINGS`` are restored afterwards.
+        """
+        stdout = _Capture(request.get('tty', False))
+        stderr = _Capture()
+        cwd = os.getcwd()
+        settings = {name: SETTINGS[name] for name in OUTPUT_SETTINGS}
+        try:
+            with contextlib.redirect_stdout(stdout), \
+                    contextlib.redirect_stderr(stderr):
+                try:
+                    os.chdir(request['cwd'])
+                    status = self.run(request['argv'])
+                except (KeyError, TypeError, OSError) as err:
+                    print('Invalid request: {0}'.format(err), file=stderr)
+                    status = 2
+        finally:
+            os.chdir(cwd)
+            SETTINGS.update(settings)
+        return {
+            'status': status,
+            'stdout': stdout.getvalue(),
+            'stderr': stderr.getvalue(),
+        }
+
+
+def receive(connection):
+    """Return the bytes received on ``connection`` until it is shut down."""
+    chunks = []
+    while True:
+        chunk = connection.recv(RECEIVE_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def listen(socket_path):
+    """Return a socket listening on the ``socket_path`` Unix socket.
+
+    A stale socket file left by a server which didn't stop cleanly is
+    removed. The socket is only accessible by the current user.
+
+    :raises OSError: When another server listens on ``socket_path``, or when
+        it is not a socket.
+    """
+    if os.path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise OSError('{0} is not a socket'.format(socket_path))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise OSError(
+                    'a server already listens on {0}'.format(socket_path))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(umask)
+    listener.listen()
+    return listener
+
+
+def _terminate(signum, frame):
+    """Exit on ``SIGTERM``, so the socket is removed."""
+    sys.exit(0)
+
+
+def serve(paths, socket_path, context=None):
+    """Serve the reports of the test modules of ``paths`` on ``socket_path``.
+
+    Runs until interrupted or terminated, then removes the socket.
+
+    :param paths: List of directories or files to find test modules.
+    :param socket_path: Path of the Unix socket to listen on.
+    :param context: Optional ``RunContext`` kept while serving.
+    :return: The exit status, ``0`` once interrupted.
+    """
+    server = Server(paths, context)
+    try:
+        listener = listen(socket_path)
+    except OSError as err:
+        print('Can not serve on {0}: {1}'.format(socket_path, err),
+              file=sys.stderr)
+        return 1
+    signal.signal(signal.SIGTERM, _terminate)
+    print('Serving {0} test module(s) on {1}'.format(
+        len(server.index.testcases), socket_path), file=sys.stderr)
+    try:
+        with listener:
+            while True:
+                connection, _ = listener.accept()
+                with connection:
+                    try:
+                        request = json.loads(
+                            receive(connection).decode('utf-8'))
+                        if not isinstance(request, dict):
+                            raise ValueError('expected a JSON object')
+                        response = server.handle(request)
+                    except ValueError as err:
+                        response = {
+                            'status': 2,
+                            'stdout': '',
+                            'stderr': 'Invalid request: {0}\n'.format(err),
+                        }
+                    try:
+                        connection.sendall(
+                            json.dumps(response).encode('utf-8'))
+                    except OSError:
+                        # The client went away
+                        continue
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
@@ -0,0 +1,215 @@
+# coding=utf-8
+"""Watch test modules and report again the ones which change."""
+import collections
+import os
+import sys
+import time
+
+from testimony import (
+    RunContext,
+    get_module_testcases,
+    get_testmodules,
+    walk_testmodules,
+)
+from testimony.cache import file_signature
+
+try:
+    import inotify_simple
+    HAS_INOTIFY = True
+except ImportError:
+    HAS_INOTIFY = False
+
+# Seconds between two checks when inotify is not available
+POLL_INTERVAL = 0.5
+
+# Milliseconds to wait for more inotify events once one is received, so a
+# burst of writes is handled at once
+INOTIFY_READ_DELAY = 50
+
+
+class WatchIndex(object):
+    """In-memory index of the test cases found on ``paths``.
+
+    The index records the ``(mtime_ns, size)`` signature of the watched
+    directories, test modules and package ``__init__.py``. ``refresh``
+    compares them with the files on disk and parses again only the test
+    modules which changed, or which live next to a changed ``__init__.py``.
+    Directories are walked again only when one of their signatures changed,
+    that is when files were added, removed or renamed.
+    """
+
+    def __init__(self, paths, context=None):
+        """Initialize the index and parse every test module of ``paths``."""
+        if context is None:
+            context = RunContext()
+        self.paths = paths
+        self.context = context
+        self.testcases = collections.OrderedDict()
+        self.directories = None
+        self._signatures = {}
+        self.refresh()
+
+    def _walk(self):
+        """Record the signature of the directories of ``paths``."""
+        directories = {}
+        for path in self.paths:
+            if os.path.isfile(path):
+                path = os.path.dirname(path) or os.curdir
+                directories[path] = file_signature(path)
+                continue
+            for dirpath, _ in walk_testmodules(path):
+                directories[dirpath] = file_signature(dirpath)
+        self.directories = directories
+
+    def _changed(self, path):
+        """Record the signature of ``path``, return whether it changed."""
+        signature = file_signature(path)
+        changed = self._signatures.get(path, False) != signature
+        self._signatures[path] = signature
+        return changed
+
+    def refresh(self):
+        """Parse again the test modules changed since the last refresh.
+
+        :return: A ``(updated, removed)`` tuple. ``updated`` is a dict mapping
+            each parsed test module path and its test cases, in the index
+            order, and ``removed`` the list of test modules no longer found.
+            Test modules which can't be parsed are reported on stderr and
+            keep their previous test cases.
+        """
+        testmodules = list(self.testcases)
+        if self.directories is None or any(
+                file_signature(dirpath) != signature
+                for dirpath, signature in self.directories.items()):
+            self._walk()
+            testmodules = get_testmodules(self.paths)
+        found = set(testmodules)
+        removed = [
+            testmodule for testmodule in self.testcases
+            if testmodule not in found
+        ]
+        for testmodule in removed:
+            self._signatures.pop(testmodule, None)
+            self.context.forget(testmodule)
+
+        stale = set()
+        pkginits = collections.OrderedDict.fromkeys(
+            os.path.join(os.path.dirname(testmodule), '__init__.py')
+            for testmodule in testmodules
+        )
+        for pkginit in pkginits:
+            if self._changed(pkginit):
+                self.context.forget(pkginit)
+                dirpath = os.path.dirname(pkginit)
+                stale.update(
+                    testmodule for testmodule in testmodules
+                    if os.path.dirname(testmodule) == dirpath
+                )
+        for testmodule in testmodules:
+            if self._changed(testmodule) or testmodule not in self.testcases:
+                stale.add(testmodule)
+
+        updated = collections.OrderedDict()
+        testcases = collections.OrderedDict()
+        for testmodule in testmodules:
+            tests = self.testcases.get(testmodule, [])
+            if testmodule in stale:
+                self.context.forget(testmodule)
+                try:
+                    tests = updated[testmodule] = get_module_testcases(
+                        testmodule, self.context)
+                except (IOError, OSError, SyntaxError, ValueError) as err:
+                    print('{0}: {1}'.format(testmodule, err), file=sys.stderr)
+            testcases[testmodule] = tests
+        self.testcases = testcases
+        return updated, removed
+
+
+class _Poller(object):
+    """Wait for changes by sleeping ``interval`` seconds."""
+
+    def __init__(self, interval=POLL_INTERVAL):
+        """Initialize the poller."""
+        self.interval = interval
+
+    def watch(self, directories):
+        """Nothing to do, files are checked after every wait."""
+
+    def wait(self):
+        """Sleep until the next check."""
+        time.sleep(self.interval)
+
+
+class _INotifyWaiter(object):
+    """Wait for changes using inotify watches on the directories."""
+
+    FLAGS = (
+        'ATTRIB',
+        'CLOSE_WRITE',
+        'CREATE',
+        'DELETE',
+        'MODIFY',
+        'MOVED_FROM',
+        'MOVED_TO',
+    )
+
+    def __init__(self):
+        """Initialize the inotify instance."""
+        self.inotify = inotify_simple.INotify()
+        self.mask = 0
+        for flag in self.FLAGS:
+            self.mask |= getattr(inotify_simple.flags, flag)
+        self.watched = set()
+
+    def watch(self, directories):
+        """Add a watch for each of ``directories`` not watched yet."""
+        for dirpath in directories:
+            if dirpath in self.watched:
+                continue
+            try:
+                self.inotify.add_watch(dirpath, self.mask)
+            except OSError:
+                continue
+            self.watched.add(dirpath)
+
+    def wait(self):
+        """Block until some event is received on the watched directories."""
+        self.inotify.read(read_delay=INOTIFY_READ_DELAY)
+
+
+def watch(report_function, paths, context=None, interval=POLL_INTERVAL):
+    """Report ``paths`` then report again the test modules when they change.
+
+    The first report covers all the test modules, the following ones only
+    the test modules parsed again, see ``WatchIndex``. Changes are detected
+    with inotify when ``inotify_simple`` is installed, otherwise the files are
+    checked every ``interval`` seconds. Runs until interrupted.
+
+    :param report_function: The report function, called with a dict mapping
+        test module paths and their test cases.
+    :param paths: List of directories or files to find test modules.
+    :param context: Optional ``RunContext`` kept during the whole watch.
+    :return: The exit status, ``0`` once interrupted.
+    """
+    index = WatchIndex(paths, context)
+    report_function(index.testcases)
+    sys.stdout.flush()
+    waiter = _INotifyWaiter() if HAS_INOTIFY else _Poller(interval)
+    try:
+        while True:
+            waiter.watch(index.directories)
+            waiter.wait()
+            start = time.perf_counter()
+            updated, removed = index.refresh()
+            if not updated and not removed:
+                continue
+            for testmodule in removed:
+                print('{0}: removed'.format(testmodule), file=sys.stderr)
+            if updated:
+                report_function(updated)
+            sys.stdout.flush()
+            print('Updated {0} test module(s) in {1:.1f}ms'.format(
+                len(updated), (time.perf_counter() - start) * 1000),
+                file=sys.stderr)
+    except KeyboardInterrupt:
+        return 0
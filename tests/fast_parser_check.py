@@ -0,0 +1,155 @@
+# coding=utf-8
+"""Check that the fast path and docutils parsers extract the same tokens.
+
+Every package, module, class and test docstring found on the given paths, as
+well as a set of edge case docstrings, is parsed with and without the fast
+path. The token names only scan is checked the same way. The edge cases
+of ``EXPECTED`` must also give the result of the original parser, which
+walked the docutils XML output. Any difference is printed and makes the
+script exit with a non-zero status.
+
+Usage::
+
+    python tests/fast_parser_check.py PATH...
+"""
+import ast
+import sys
+
+from testimony import get_testmodules
+from testimony.parser import DocstringParser, FastPathUnsupported, scan_fields
+
+EDGE_CASES = [
+    '',
+    'Summary line only.',
+    'Summary.\n\n:Feature: Plain\n:Assert: Consecutive fields',
+    'Summary.\n:Feature: Field right after a paragraph',
+    ':Feature: Field list\nParagraph right after a field list',
+    ':Feature:\n:Assert: Empty field body',
+    ':Feature: Value\n:feature: Duplicated lowercase name',
+    ':Steps: 1. First\n        2. Second\n\n:Assert: ok',
+    ':Steps:\n    1. First\n    2. Second',
+    ':Steps:\n    1. First\n\n    2. Second separated by a blank line',
+    ':Steps:\n    1. First item spans\n       two lines\n    2. Second',
+    ':Steps:\n    1. First\n    lines not indented',
+    ':Steps:\n    1. First\n    3. Not the next item',
+    ':Steps:\n    2. Not starting at one',
+    ':Steps:\n    1) Other enumerator',
+    ':Steps:\n    - Bullet list',
+    ':Steps: 1. First\n\n         Second paragraph of the item',
+    ':Feature: Paragraph\n    spanning lines',
+    ':Feature: Paragraph\n\n    Second paragraph',
+    ':Feature: *Emphasis*',
+    ':Feature: ``literal``',
+    ':Feature: Reference_',
+    ':Feature: snake_case_value',
+    ':Feature: __init__.py',
+    ':BZ: https://bugzilla.example.com/123',
+    ':Author: user@example.com',
+    ':Feature: Colon: in the value',
+    ':Feature: 10:30',
+    'Title\n=====\n\n:Feature: Section',
+    'Summary.\n\n----\n\n:Feature: Transition',
+    'Summary.\n\n.. note:: Directive\n\n:Feature: Value',
+    'Summary::\n\n    Literal block\n\n:Feature: Value',
+    'Summary.\n\n    Block quote\n\n:Feature: Value',
+    'Term\n    Definition\n\n:Feature: Value',
+    'Summary.\n\n>>> doctest\n\n:Feature: Value',
+    'Summary.\n\n| line block\n\n:Feature: Value',
+    ':Feature: Tab\tseparated',
+    ':Feature: Escaped \\* star',
+    ':Feature : Space before colon',
+    ':Feature:Value without space',
+    'Summary with ``literal``.\n\n:Feature: Value',
+    ':Feature: Value with *emphasis*\n:Assert: ok',
+    ':Feature: Value\n    continued with `reference`_',
+    ':Feature: Value with tel:123',
+    ':Feature: tel:123',
+    ':Feature: Value *unclosed',
+    ':Steps:\n    1. ``First``\n    2. Second with `ref`_',
+    ':Feature name: Field name with spaces',
+    ':Feature: Value::\n\n    Literal block',
+    'Summary.\n\n__ https://example.com\n\n:Feature: Value',
+    ':BZ: ``123``',
+    ':Steps: \n\x0c0+\u00e90',
+    ':Feature: Vertical\x0btab\n:Assert: ok',
+]
+
+# Results of the original parser, a value starting with inline markup is
+# ``None`` but its token is still valid, unlike a field with an empty body
+EXPECTED = {
+    ':BZ: ``123``': ({'bz': None}, {}, []),
+    ':Feature:\n:Assert: Empty field body': (
+        {'assert': 'Empty field body'}, {'feature': ''}, []),
+}
+
+
+def docstrings(paths):
+    """Yield the docstrings found on the test modules of ``paths``."""
+    for testmodule in get_testmodules(paths):
+        with open(testmodule) as handler:
+            root = ast.parse(handler.read())
+        for node in ast.walk(root):
+            if isinstance(
+                    node, (ast.Module, ast.ClassDef, ast.FunctionDef)):
+                docstring = ast.get_docstring(node)
+                if docstring is not None:
+                    yield docstring
+
+
+def outcome(parse, docstring):
+    """Return the result of ``parse`` or the name of its exception."""
+    try:
+        return parse(docstring)
+    except Exception as err:
+        return type(err).__name__
+
+
+def names(result):
+    """Return the ``parse_names`` result matching a ``parse`` result."""
+    if isinstance(result, str):
+        return result
+    return list(result[0]), list(result[1])
+
+
+def main(paths):
+    """Compare both parsers and return the number of mismatches."""
+    fast_parser = DocstringParser(fast=True)
+    docutils_parser = DocstringParser(fast=False)
+    total = fast = fast_names = mismatches = 0
+    for docstring in list(docstrings(paths)) + EDGE_CASES:
+        total += 1
+        for names_only in (False, True):
+            try:
+                scan_fields(docstring, names_only)
+            except FastPathUnsupported:
+                continue
+            if names_only:
+                fast_names += 1
+            else:
+                fast += 1
+        expected = outcome(docutils_parser.parse, docstring)
+        if docstring in EXPECTED and expected != EXPECTED[docstring]:
+            mismatches += 1
+            print('Unexpected result for {0!r}:\n  docutils: {1!r}\n'
+                  '  expected: {2!r}'.format(
+                      docstring, expected, EXPECTED[docstring]))
+        result = outcome(fast_parser.parse, docstring)
+        if result != expected:
+            mismatches += 1
+            print('Mismatch for {0!r}:\n  fast: {1!r}\n  docutils: {2!r}'
+                  .format(docstring, result, expected))
+        result = outcome(fast_parser.parse_names, docstring)
+        if result != names(expected):
+            mismatches += 1
+            print('Names mismatch for {0!r}:\n  fast: {1!r}\n'
+                  '  docutils: {2!r}'.format(
+                      docstring, result, names(expected)))
+    print('Docstrings: {0}'.format(total))
+    print('Parsed by the fast path: {0}'.format(fast))
+    print('Names scanned by the fast path: {0}'.format(fast_names))
+    print('Mismatches: {0}'.format(mismatches))
+    return mismatches
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1:]) else 0)
@@ -0,0 +1,141 @@
+# coding=utf-8
+"""Check that the testimony commands start without the heavy dependencies.
+
+``python -X importtime`` is run on the ``testimony`` and ``testimony-client``
+command modules, with bytecode cached on a temporary directory, and checks
+that:
+
+* none of ``HEAVY_MODULES`` is imported at startup, they are imported when a
+  code path needs them;
+* the startup cost of testimony's own modules, the ``testimony.cli`` import
+  time minus the ``click`` one, stays under ``CLICK_RATIO`` times the
+  ``click`` import time. The cost is compared with ``click`` so the check
+  doesn't depend on the machine speed;
+* docutils is only imported for the docstrings the fast path can't parse,
+  yaml only when a configuration file is parsed, and termcolor is imported
+  when the ``testimony.HAS_TERMCOLOR`` compatibility name is first read.
+
+Any failed check makes the script exit with a non-zero status.
+
+Usage::
+
+    python tests/import_time_check.py
+"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = (
+    'concurrent.futures',
+    'docutils',
+    'termcolor',
+    'urllib.request',
+    'xml.sax',
+    'yaml',
+)
+
+COMMAND_MODULES = ('testimony.cli', 'testimony.client')
+
+CLICK_RATIO = 2.5
+
+# Best of this many runs, the import time varying between runs
+RUNS = 5
+
+
+def import_times(module, pycache_prefix):
+    """Return the ``{name: cumulative microseconds}`` of ``module`` imports."""
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-X',
+         'pycache_prefix=' + pycache_prefix, '-c', 'import ' + module],
+        check=True,
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times.setdefault(name.strip(), int(cumulative))
+    return times
+
+
+def heavy_modules(names):
+    """Return the sorted ``HEAVY_MODULES`` found in ``names``."""
+    return sorted(
+        heavy for heavy in HEAVY_MODULES
+        if any(name == heavy or name.startswith(heavy + '.') for name in names)
+    )
+
+
+def check_startup():
+    """Check the modules imported by the commands and their import time."""
+    failed = False
+    with tempfile.TemporaryDirectory() as pycache_prefix:
+        for module in COMMAND_MODULES:
+            # Cache the bytecode first
+            times = import_times(module, pycache_prefix)
+            found = heavy_modules(times)
+            print('{0} imports {1}'.format(
+                module, ', '.join(found) if found else 'no heavy module'))
+            failed = failed or bool(found)
+        runs = [
+            import_times('testimony.cli', pycache_prefix) for _ in range(RUNS)]
+    own = min(times['testimony.cli'] - times['click'] for times in runs)
+    click = min(times['click'] for times in runs)
+    under_cap = own < click * CLICK_RATIO
+    print('testimony.cli startup under {0}x the click import time: {1}'.format(
+        CLICK_RATIO, under_cap))
+    return failed or not under_cap
+
+
+def check_lazy_imports():
+    """Check that docutils, yaml and termcolor are imported only when needed.
+
+    ``testimony.HAS_TERMCOLOR`` is still available, it imports termcolor.
+    """
+    import testimony
+    from testimony import config
+    from testimony.parser import DocstringParser
+
+    parser = DocstringParser()
+    parser.parse('Test summary.\n\n:Feature: Plain fields\n:Assert: Parsed')
+    plain = 'docutils' in sys.modules
+    parser.parse('Test summary.\n\n:Feature: *Emphasis*')
+    markup = 'docutils' in sys.modules
+    print('docutils imported for plain fields: {0}'.format(plain))
+    print('docutils imported for inline markup: {0}'.format(markup))
+    without_config = 'yaml' in sys.modules
+    config.parse_config(io.StringIO('Status:\n    type: string\n'))
+    with_config = 'yaml' in sys.modules
+    print('yaml imported without a configuration: {0}'.format(
+        without_config))
+    print('yaml imported with a configuration: {0}'.format(with_config))
+    without_name = 'termcolor' in sys.modules
+    has_termcolor = testimony.HAS_TERMCOLOR
+    with_name = has_termcolor == ('termcolor' in sys.modules)
+    print('termcolor imported without HAS_TERMCOLOR: {0}'.format(
+        without_name))
+    print('HAS_TERMCOLOR tells whether termcolor is imported: {0}'.format(
+        with_name))
+    return (
+        plain or not markup or without_config or not with_config or
+        without_name or not with_name
+    )
+
+
+def main():
+    """Run the checks, exit with a non-zero status if any failed."""
+    failed = check_startup()
+    failed = check_lazy_imports() or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
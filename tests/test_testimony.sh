@@ -64,3 +64,403 @@ echo -n "default summary report length: "
 testimony -n summary tests |wc -l
 echo -n "--tokens --minimum-tokens --config summary report length: "
 testimony -n --tokens "bz" --minimum-tokens "status" --config tests/config-basic.yaml summary tests |wc -l
+
+echo
+echo "====================================================="
+echo "= changed package init should pull its test modules ="
+echo "====================================================="
+echo
+printf 'tests/sample_pkg/__init__.py\nREADME.rst\n' | testimony -n --changed-files - summary tests
+
+echo
+echo "==================================================="
+echo "= fast path parser should extract the same tokens ="
+echo "==================================================="
+echo
+python tests/fast_parser_check.py tests
+
+echo
+echo "================================================="
+echo "= the parse cache should skip unchanged modules ="
+echo "================================================="
+echo
+tmpdir=$(mktemp -d)
+cp -r tests "${tmpdir}/tests"
+cache="${tmpdir}/cache"
+(
+    cd "${tmpdir}"
+    echo -n "first run: "
+    testimony -n --cache-dir "${cache}" summary tests 2>&1 >/dev/null
+    echo -n "second run: "
+    testimony -n --cache-dir "${cache}" summary tests 2>&1 >/dev/null
+    echo -n "after touching every module: "
+    find tests -name '*.py' -exec touch {} +
+    testimony -n --cache-dir "${cache}" summary tests 2>&1 >/dev/null
+    echo -n "after editing sample_pkg/__init__.py: "
+    echo '# Changed' >> tests/sample_pkg/__init__.py
+    testimony -n --cache-dir "${cache}" summary tests 2>&1 >/dev/null
+)
+echo -n "modules hashed once their signatures are recorded again: "
+(cd "${tmpdir}" && python -c '
+import os
+from testimony import cache
+from testimony.config import TokenConfig
+parse_cache = cache.ParseCache("cache", {"feature": TokenConfig("feature", {})})
+parse_cache.set("tests/test_sample.py", [])
+os.utime("tests/test_sample.py", ns=(0, 0))
+hashed = []
+file_digest = cache.file_digest
+cache.file_digest = lambda path: hashed.append(path) or file_digest(path)
+parse_cache.get("tests/test_sample.py")
+parse_cache.get("tests/test_sample.py")
+print(len(hashed))')
+echo -n "cache directory tracked by git: "
+(
+    cd "${tmpdir}"
+    git init -q repository
+    cp -r "${cache}" repository/.testimony_cache
+    cd repository
+    git add .testimony_cache
+    testimony -n --cache summary ../tests 2>&1 >/dev/null
+)
+rm -rf "${tmpdir}"
+
+echo
+echo "====================================================="
+echo "= parallel jobs should not change the report output ="
+echo "====================================================="
+echo
+tmpdir=$(mktemp -d)
+for args in "print tests" "validate tests" "summary tests" \
+        "--config tests/config-full.yaml validate tests"; do
+    testimony -n --jobs 1 ${args} > "${tmpdir}/jobs1" 2>&1
+    jobs1=$?
+    testimony -n --jobs 2 ${args} > "${tmpdir}/jobs2" 2>&1
+    jobs2=$?
+    if cmp -s "${tmpdir}/jobs1" "${tmpdir}/jobs2" &&
+            [ "${jobs1}" -eq "${jobs2}" ]; then
+        echo "${args}: same output and status"
+    else
+        echo "${args}: different output or status"
+    fi
+done
+rm -r "${tmpdir}"
+
+echo
+echo "============================================="
+echo "= include and exclude should select modules ="
+echo "============================================="
+echo
+echo -n "--exclude sample_pkg: "
+testimony -n --exclude sample_pkg summary tests | head -1
+echo -n "--exclude 'tests/sample_pkg/*' on ./tests: "
+testimony -n --exclude 'tests/sample_pkg/*' summary ./tests | head -1
+echo -n "--exclude 'tests/sample_pkg/*' on an absolute path: "
+testimony -n --exclude 'tests/sample_pkg/*' summary "$(pwd)/tests" | head -1
+echo -n "--exclude 'tests/sample_pkg/*' on changed files: "
+echo tests/sample_pkg/test_sample2.py |
+    testimony -n --exclude 'tests/sample_pkg/*' --changed-files - \
+        summary ./tests | head -1
+echo -n "--include test_sample?.py: "
+testimony -n --include 'test_sample?.py' summary tests | head -1
+
+echo
+echo "================================================"
+echo "= modules without test definitions are skipped ="
+echo "================================================"
+echo
+tmpdir=$(mktemp -d)
+printf 'import os\nthis is not python(\n' > "${tmpdir}/test_helpers.py"
+(cd "${tmpdir}" && testimony -n print test_helpers.py)
+rm -r "${tmpdir}"
+
+echo
+echo "========================================"
+echo "= profile should report the run stages ="
+echo "========================================"
+echo
+testimony -n --json --profile validate tests 2>&1 >/dev/null | python -c '
+import json, sys
+profile = json.load(sys.stdin)
+print(" ".join(sorted(profile["stages"])))
+print(" ".join(profile["counters"]))'
+
+echo
+echo "======================================================="
+echo "= nested, async and conditional tests should be found ="
+echo "======================================================="
+echo
+tmpdir=$(mktemp -d)
+cat > "${tmpdir}/test_nested.py" <<'PY'
+import sys
+
+
+class TestOuter:
+    class TestInner:
+        def test_inner(self):
+            """Nested class test."""
+
+    def test_outer(self):
+        def test_not_collected():
+            pass
+
+
+async def test_async():
+    """Async test."""
+
+
+if sys.version_info:
+    def test_in_if():
+        pass
+else:
+    def test_in_else():
+        pass
+
+try:
+    import test_missing  # noqa
+except ImportError:
+    def test_in_except():
+        pass
+PY
+(cd "${tmpdir}" && testimony -n print test_nested.py | grep -E ':[0-9]+$')
+rm -r "${tmpdir}"
+
+echo
+echo "============================================="
+echo "= jsonl should print one test case per line ="
+echo "============================================="
+echo
+testimony -n --jsonl print tests | python -c '
+import json, sys
+lines = sys.stdin.read().splitlines()
+print("print lines:", len(lines))
+print("same as --json:", [json.loads(line) for line in lines] == json.loads(
+    sys.argv[1]))' "$(testimony -n --json print tests)"
+testimony -n --jsonl validate tests | python -c '
+import json, sys
+for line in sys.stdin:
+    issue = json.loads(line)
+    print(issue["file-path"], issue["test"], len(issue["issues"]))'
+
+echo
+echo "==================================================="
+echo "= validate should support junit and sarif formats ="
+echo "==================================================="
+echo
+testimony --format junit validate tests | python -c '
+import sys
+import xml.etree.ElementTree as ET
+for suite in ET.parse(sys.stdin).getroot():
+    print(suite.get("name"), suite.get("tests"), suite.get("failures"))
+    for testcase in suite.iter("testcase"):
+        for failure in testcase.iter("failure"):
+            print(" ", testcase.get("line"), testcase.get("classname"),
+                  testcase.get("name"), failure.get("type"))'
+testimony --format sarif validate tests | python -c '
+import json, sys
+run = json.load(sys.stdin)["runs"][0]
+for result in run["results"]:
+    location = result["locations"][0]["physicalLocation"]
+    print(location["artifactLocation"]["uri"],
+          location["region"]["startLine"], result["ruleId"])'
+
+echo
+echo "======================================================="
+echo "= serve should answer like the command line it serves ="
+echo "======================================================="
+echo
+tmpdir=$(mktemp -d)
+testimony serve --socket "${tmpdir}/socket" tests 2>/dev/null &
+server=$!
+tries=0
+while [ ! -S "${tmpdir}/socket" ] && [ "${tries}" -lt 100 ]; do
+    sleep 0.1
+    tries=$((tries + 1))
+done
+for args in "-n print tests" "-n validate tests/test_sample.py" \
+        "--json summary tests/sample_pkg" "--format junit validate tests"; do
+    testimony ${args} > "${tmpdir}/expected" 2>&1
+    expected=$?
+    testimony-client --socket "${tmpdir}/socket" ${args} \
+        > "${tmpdir}/served" 2>&1
+    served=$?
+    if cmp -s "${tmpdir}/expected" "${tmpdir}/served" &&
+            [ "${expected}" -eq "${served}" ]; then
+        echo "${args}: same output and status"
+    else
+        echo "${args}: different output or status"
+    fi
+done
+mkdir "${tmpdir}/other"
+for feature in OldFeature NewFeature; do
+    printf '"""Module.\n\n:Feature: %s\n"""\n\n\ndef test_o():\n    """Test."""\n' \
+        "${feature}" > "${tmpdir}/other/test_o.py"
+    echo -n "unserved module with ${feature}: "
+    testimony-client --socket "${tmpdir}/socket" -n print "${tmpdir}/other" |
+        grep -A1 Feature: | tail -1
+done
+echo -n "request with --jobs: "
+testimony-client --socket "${tmpdir}/socket" --jobs 2 print tests 2>&1 |
+    tail -1
+kill "${server}"
+wait "${server}"
+echo -n "socket removed: "
+[ -e "${tmpdir}/socket" ] && echo no || echo yes
+rm -r "${tmpdir}"
+
+echo
+echo "==========================================="
+echo "= startup should not import heavy modules ="
+echo "==========================================="
+echo
+python tests/import_time_check.py
+
+echo
+echo "======================================================"
+echo "= the parse memo should return copies of its results ="
+echo "======================================================"
+echo
+python -c '
+from testimony import RunContext
+
+docstring = "Test.\n\n:Feature: Memo\n:Assert: Parsed once"
+parser = RunContext(memo_size=2).parser
+valid_tokens, invalid_tokens, messages = parser.parse(docstring)
+valid_tokens["feature"] = "Changed"
+invalid_tokens["unexpected"] = "Changed"
+messages.append("Changed")
+print("identical docstring:", parser.parse(docstring))
+print("hits and misses:", parser.memo_hits, parser.memo_misses)
+for index in range(3):
+    parser.parse("Test {0}.\n\n:Feature: Memo".format(index))
+print("kept results:", len(parser._memo))
+parser = RunContext(memo_size=0).parser
+parser.parse(docstring)
+parser.parse(docstring)
+print("disabled memo hits and misses:", parser.memo_hits, parser.memo_misses)'
+for memo_size in 0 4096; do
+    echo -n "--memo-size ${memo_size} counters: "
+    testimony -n --json --profile --jobs 1 --memo-size "${memo_size}" \
+        validate tests 2>&1 >/dev/null | python -c '
+import json, sys
+print(json.load(sys.stdin)["counters"])'
+done
+
+echo
+echo "===================================================="
+echo "= watch index should parse again only what changed ="
+echo "===================================================="
+echo
+tmpdir=$(mktemp -d)
+(cd "${tmpdir}" && python -c '
+import itertools
+import os
+from testimony.watch import WatchIndex
+
+# Explicit modification times, so each change is seen whatever the file
+# system timestamp resolution
+times = itertools.count(10 ** 18, 10 ** 9)
+
+
+def write(path, source):
+    with open(path, "w") as handler:
+        handler.write(source)
+    bump(path)
+
+
+def bump(*paths):
+    for path in paths:
+        mtime = next(times)
+        os.utime(path, ns=(mtime, mtime))
+
+
+def show(label, result):
+    updated, removed = result
+    print("{0}: updated {1}, removed {2}".format(
+        label,
+        sorted("{0} ({1})".format(path, len(tests))
+               for path, tests in updated.items()),
+        sorted(removed),
+    ))
+
+
+os.mkdir("pkg")
+write("pkg/__init__.py", "\"\"\"Package.\"\"\"\n")
+write("pkg/test_a.py", "def test_a():\n    pass\n")
+write("pkg/test_b.py", "def test_b():\n    pass\n")
+write("test_top.py", "def test_top():\n    pass\n")
+bump(".", "pkg")
+index = WatchIndex(["."])
+print("indexed:", sorted(index.testcases))
+show("nothing changed", index.refresh())
+write("test_top.py", "def test_top():\n    pass\n\n\ndef test_new():\n    pass\n")
+show("module modified", index.refresh())
+bump("pkg/__init__.py")
+show("__init__.py touched", index.refresh())
+os.mkdir("pkg/sub")
+write("pkg/sub/test_c.py", "def test_c():\n    pass\n")
+bump("pkg/sub", "pkg")
+show("subdirectory added", index.refresh())
+os.remove("pkg/test_b.py")
+bump("pkg")
+show("module deleted", index.refresh())
+print("indexed:", sorted(index.testcases))
+')
+rm -r "${tmpdir}"
+
+echo
+echo "==================================================="
+echo "= token types should be validated from the config ="
+echo "==================================================="
+echo
+tmpdir=$(mktemp -d)
+cat > "${tmpdir}/test_types.py" <<'PY'
+def test_valid_values():
+    """Test valid values.
+
+    :Assert: Every value is valid
+    :Feature: Token types
+    :BZ: 123456
+    :Status: AUTOMATED
+    :Tags: t1, t3
+    :Id: 0a1b2c3d
+    :Link: https://example.com/issues/1
+    """
+
+
+def test_invalid_values():
+    """Test invalid values.
+
+    :Assert: Every value is invalid
+    :Feature: Token types
+    :BZ: 12ab
+    :Status: Pending
+    :Tags: t1, t4
+    :Id: 0a1b2c3d4e
+    :Link: example.com/issues/1
+    """
+
+
+def test_markup_values():
+    """Test values starting with inline markup, which have no value.
+
+    :Assert: Every typed value is invalid
+    :Feature: Token types
+    :BZ: ``123456``
+    :Status: *manual*
+    :Tags: ``t1``
+    :Id: ``0a1b2c3d``
+    :Link: `link <https://example.com>`_
+    """
+PY
+config="$(pwd)/tests/config-types.yaml"
+(cd "${tmpdir}" && testimony -n --config "${config}" validate test_types.py)
+rm -r "${tmpdir}"
+echo -n "typed tokens validate values once pickled: "
+python -c '
+import pickle
+from testimony.config import parse_config
+with open("tests/config-types.yaml") as handler:
+    tokens = pickle.loads(pickle.dumps(parse_config(handler)))
+print(tokens["status"].validate("MANUAL"), tokens["tags"].validate("t4"),
+      tokens["id"].validate("0a1b2c3d"), tokens["link"].validate("x"))'